@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Face Index Benchmark
+
+Measures identify matching latency (exact scan vs IVF approximate search vs
+per-person prototypes) and recall on synthetic face embeddings at 10, 1k and
+50k enrolled photos.
+Uses the same index code as server.py, so results reflect the live server.
+
+Usage:
+    python3 bench_face_index.py [--dim N] [--queries 200] [--sizes 10,1000,50000] [--with-model]
+
+    --dim           Embedding size (default: the configured FACE_MODEL's, e.g. VGG-Face = 4096)
+    --queries       Number of identify queries per size
+    --sizes         Comma-separated enrolled photo counts
+    --with-model    Also time one real embedding of a known_faces photo, so the
+                    totals show full identify latency (needs DeepFace installed)
+"""
+
+import sys
+import time
+import argparse
+import numpy as np
+
+import server
+
+PHOTOS_PER_PERSON = 5
+NPROBES = [1, 4, 8, 16, 32]
+
+
+def synthetic_embeddings(n, dim, rng):
+    """n L2-normalized embeddings: PHOTOS_PER_PERSON noisy photos around each person's center"""
+    people = max(1, n // PHOTOS_PER_PERSON)
+    centers = rng.standard_normal((people, dim)).astype(np.float32)
+    labels = np.arange(n) % people
+    rows = centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+    return rows, labels, centers
+
+
+def percentile_ms(samples, pct):
+    return np.percentile(samples, pct) * 1000
+
+
+def report(name, latencies, embed_seconds, extra=""):
+    line = f"  {name:<12} p50 {percentile_ms(latencies, 50):8.2f} ms   p95 {percentile_ms(latencies, 95):8.2f} ms"
+    if embed_seconds:
+        line += f"   identify ~{(np.median(latencies) + embed_seconds) * 1000:.0f} ms"
+    print(line + extra)
+
+
+def time_searches(index, queries, search=server.search_index, **kwargs):
+    """Run every query, return (latencies in seconds, best labels)"""
+    latencies, labels = [], []
+    for q in queries:
+        start = time.perf_counter()
+        label, _, _ = search(index, q, **kwargs)
+        latencies.append(time.perf_counter() - start)
+        labels.append(label)
+    return latencies, labels
+
+
+def time_model_embedding():
+    """Time one real embedding (the fixed per-identify model cost)"""
+    photos = list(server.list_known_photos())
+    if not photos:
+        print("  No known_faces photos to embed - skipping model timing")
+        return 0.0
+    frame = server.decode_image(photos[0][1].read_bytes())
+    server.embed_face_image_local(frame)  # Load the model first
+    start = time.perf_counter()
+    server.embed_face_image_local(frame)
+    return time.perf_counter() - start
+
+
+def bench_size(n, dim, n_queries, rng, embed_seconds):
+    rows, labels, centers = synthetic_embeddings(n, dim, rng)
+    index = server.make_face_index(rows, [str(x) for x in labels], [f"{x}.jpg" for x in range(n)], [0.0] * n)
+
+    # Queries are fresh photos of enrolled people
+    people = rng.integers(0, len(centers), n_queries)
+    queries = centers[people] + 0.6 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+
+    print(f"\n{n} photos ({len(centers)} people, {dim}-d, {rows.nbytes / 1024**2:.1f} MB)")
+    exact_lat, exact_labels = time_searches(index, queries, exact=True)
+    report("exact", exact_lat, embed_seconds)
+
+    if n < 2:
+        return
+    start = time.perf_counter()
+    index["ivf"] = server.train_ivf(rows)
+    print(f"  IVF: {len(index['ivf']['centroids'])} lists trained in {time.perf_counter() - start:.2f}s")
+
+    for nprobe in NPROBES:
+        if nprobe > len(index['ivf']['centroids']):
+            break
+        lat, ann_labels = time_searches(index, queries, nprobe=nprobe)
+        recall = np.mean([a == b for a, b in zip(ann_labels, exact_labels)])
+        report(f"nprobe={nprobe}", lat, embed_seconds, f"   recall@1 {recall:.3f}")
+
+    # Prototype mode: centroids (k=1) or k-medoids per person, then re-rank raw photos
+    for k in (1, 3):
+        start = time.perf_counter()
+        index["prototypes"] = server.build_face_prototypes(index, k=k)
+        built = time.perf_counter() - start
+        lat, proto_labels = time_searches(index, queries, search=server.search_prototypes)
+        recall = np.mean([a == b for a, b in zip(proto_labels, exact_labels)])
+        report(f"prototype k={k}", lat, embed_seconds, f"   recall@1 {recall:.3f}   (built in {built:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark face index search latency and recall")
+    parser.add_argument('--dim', type=int, default=server.FACE_EMBEDDING_DIMS)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--sizes', default='10,1000,50000')
+    parser.add_argument('--with-model', action='store_true')
+    args = parser.parse_args()
+
+    embed_seconds = 0.0
+    if args.with_model:
+        embed_seconds = time_model_embedding()
+        print(f"Model embedding ({server.FACE_MODEL_NAME}): {embed_seconds * 1000:.0f} ms per frame")
+
+    print(f"Server defaults: exact below {server.FACE_ANN_MIN_SIZE} photos, nprobe={server.FACE_ANN_NPROBE}")
+    rng = np.random.default_rng(0)
+    for n in [int(x) for x in args.sizes.split(',')]:
+        bench_size(n, args.dim, args.queries, rng, embed_seconds)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Face Model Benchmark
+
+Compares the face models in server.FACE_MODELS on our own enrolled faces
+(known_faces/) so we can switch FACE_MODEL to something lighter without
+silently breaking matching. For each model it reports, on CPU:
+  - model load time and resident memory
+  - per-face embedding latency (p50 / p95)
+  - leave-one-out accuracy: each photo must match another photo of the same
+    person under the model's threshold
+  - genuine reject rate and (with 2+ people) impostor accept rate
+
+Each model runs in a fresh process, so memory numbers aren't polluted by the
+previous model.
+
+Usage:
+    python3 bench_face_models.py [--models VGG-Face,Facenet512,SFace]
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+import numpy as np
+
+
+def bench_model(model_name):
+    """Benchmark one model (runs in its own process)"""
+    os.environ.setdefault('CUDA_VISIBLE_DEVICES', '-1')  # CPU numbers, like production
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import psutil
+    import server
+
+    proc = psutil.Process()
+    rss_start = proc.memory_info().rss
+
+    start = time.perf_counter()
+    server.get_deepface().build_model(model_name)
+    load_seconds = time.perf_counter() - start
+
+    embeddings, labels, latencies = [], [], []
+    for name, photo in server.list_known_photos():
+        crop_path = server.face_crop_path(photo)
+        if crop_path.exists():
+            img, detector = server.decode_image(crop_path.read_bytes()), 'skip'
+        else:
+            img, detector = server.decode_image(photo.read_bytes()), 'opencv'
+        start = time.perf_counter()
+        faces = server.embed_face_image_local(img, detector, model_name=model_name)
+        latencies.append(time.perf_counter() - start)
+        if faces:
+            embeddings.append(server.normalize_embedding(faces[0]['embedding']))
+            labels.append(name)
+
+    result = {
+        "model": model_name,
+        "load_seconds": load_seconds,
+        "rss_mb": (proc.memory_info().rss - rss_start) / 1024**2,
+        "photos": len(labels),
+        "p50_ms": np.percentile(latencies[1:] or latencies, 50) * 1000,  # First call includes graph setup
+        "p95_ms": np.percentile(latencies[1:] or latencies, 95) * 1000
+    }
+    if len(labels) < 2:
+        return result
+
+    threshold = server.FACE_MODELS[model_name]["threshold"]
+    matrix = np.vstack(embeddings)
+    labels = np.array(labels)
+    distances = 1.0 - matrix @ matrix.T
+    np.fill_diagonal(distances, np.inf)
+
+    nearest = np.argmin(distances, axis=1)
+    nearest_distance = distances[np.arange(len(labels)), nearest]
+    result["accuracy"] = float(np.mean((labels[nearest] == labels) & (nearest_distance < threshold)))
+
+    same = labels[:, None] == labels[None, :]
+    off_diagonal = ~np.eye(len(labels), dtype=bool)
+    genuine = distances[same & off_diagonal]
+    impostor = distances[~same]
+    result["genuine_reject"] = float(np.mean(genuine >= threshold)) if len(genuine) else None
+    result["impostor_accept"] = float(np.mean(impostor < threshold)) if len(impostor) else None
+    return result
+
+
+def format_rate(value):
+    return "   n/a" if value is None else f"{value * 100:5.1f}%"
+
+
+def main():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import server
+
+    parser = argparse.ArgumentParser(description="Benchmark face models on known_faces")
+    parser.add_argument('--models', default=','.join(server.FACE_MODELS))
+    args = parser.parse_args()
+    models = [m.strip() for m in args.models.split(',') if m.strip()]
+
+    unknown = [m for m in models if m not in server.FACE_MODELS]
+    if unknown:
+        print(f"Unknown models: {unknown} (choose from {', '.join(server.FACE_MODELS)})")
+        return 1
+
+    print(f"Benchmarking {len(models)} models on {len(list(server.list_known_photos()))} known photos "
+          f"(current FACE_MODEL: {server.FACE_MODEL_NAME})\n")
+    print(f"{'model':<14}{'load':>8}{'memory':>10}{'p50':>10}{'p95':>10}{'accuracy':>10}{'gen.rej':>9}{'imp.acc':>9}")
+
+    ctx = multiprocessing.get_context('spawn')
+    for model_name in models:
+        with ctx.Pool(1) as pool:
+            try:
+                r = pool.apply(bench_model, (model_name,))
+            except Exception as e:
+                print(f"{model_name:<14} failed: {e}")
+                continue
+        print(f"{r['model']:<14}{r['load_seconds']:>7.1f}s{r['rss_mb']:>8.0f}MB{r['p50_ms']:>8.0f}ms{r['p95_ms']:>8.0f}ms"
+              f"{format_rate(r.get('accuracy')):>10}{format_rate(r.get('genuine_reject')):>9}{format_rate(r.get('impostor_accept')):>9}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
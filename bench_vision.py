@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Vision Pipeline Benchmark
+
+Measures /api/vision latency through the real server code path (frame ingest,
+downscaling, description cache, request coalescing) for three patterns:
+new scene on every call, repeated calls on an unchanged scene, and a burst of
+concurrent calls on one new scene.
+Runs on the offline backend by default, so no network or API key is needed.
+
+Usage:
+    python3 bench_vision.py [--backend offline] [--latency 1.5] [--requests 20] [--burst 8]
+
+    --backend       Vision backend (offline, or gemini with GEMINI_API_KEY set)
+    --latency       Simulated model round trip for the offline backend (seconds)
+    --requests      Calls per sequential pattern
+    --burst         Concurrent calls in the burst pattern
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+from PIL import Image
+
+
+def synthetic_frame(rng, size=(1280, 720)):
+    """A distinct webcam-sized JPEG: smooth random blobs, so every frame hashes differently"""
+    small = rng.integers(0, 256, (9, 16, 3), dtype=np.uint8)
+    img = Image.fromarray(small).resize(size, Image.BICUBIC)
+    buf = io.BytesIO()
+    img.save(buf, 'JPEG', quality=85)
+    return buf.getvalue()
+
+
+def report(label, latencies, calls_before, server):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000
+    calls = server.vision_flight_stats["model_calls"] - calls_before
+    print(f"  {label:<28} p50 {p50:8.1f} ms   p95 {p95:8.1f} ms   model calls {calls}/{len(latencies)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vision pipeline latency benchmark")
+    parser.add_argument("--backend", default="offline")
+    parser.add_argument("--latency", type=float, default=1.5)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--burst", type=int, default=8)
+    args = parser.parse_args()
+
+    os.environ["VISION_BACKEND"] = args.backend
+    os.environ["VISION_OFFLINE_LATENCY"] = str(args.latency)
+    os.environ.setdefault("VISION_PREFETCH", "false")
+    import server
+
+    client = server.app.test_client()
+    rng = np.random.default_rng(0)
+
+    def post_frame(data):
+        client.post('/api/frame', data=data, content_type='image/jpeg', headers={'X-Session-Id': 'bench'})
+
+    def timed_vision(results):
+        started = time.perf_counter()
+        server.app.test_client().get('/api/vision', headers={'X-Session-Id': 'bench'})
+        results.append(time.perf_counter() - started)
+
+    print(f"Vision benchmark: backend={server.vision_engine.backend.name}, "
+          f"max_edge={server.VISION_MAX_EDGE}, cache_ttl={server.VISION_CACHE_TTL}s")
+
+    calls = server.vision_flight_stats["model_calls"]
+    latencies = []
+    for _ in range(args.requests):
+        post_frame(synthetic_frame(rng))
+        timed_vision(latencies)
+    report("new scene every call", latencies, calls, server)
+
+    calls = server.vision_flight_stats["model_calls"]
+    latencies = []
+    for _ in range(args.requests):
+        timed_vision(latencies)
+    report("unchanged scene", latencies, calls, server)
+
+    calls = server.vision_flight_stats["model_calls"]
+    latencies = []
+    post_frame(synthetic_frame(rng))
+    threads = [threading.Thread(target=timed_vision, args=(latencies,)) for _ in range(args.burst)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report(f"burst of {args.burst} on new scene", latencies, calls, server)
+
+    preprocess = server.vision_image_report()
+    print(f"  upload size: {preprocess['avg_original_kb']} KB captured -> {preprocess['avg_sent_kb']} KB sent "
+          f"({preprocess['avg_prepare_ms']} ms to prepare)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,17 +11,28 @@ import os
 import base64
 import json
 import shutil
+import struct
+import itertools
+import multiprocessing
+import queue
 import tempfile
 import sqlite3
 import subprocess
 import time
+import threading
+import numpy as np
 import psutil
+import io
 import requests
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from dotenv import load_dotenv
+from PIL import Image
 import google.generativeai as genai
 
 # Load environment variables (use explicit path to avoid picking up parent .env files)
@@ -29,7 +40,7 @@ env_path = Path(__file__).parent / ".env"
 load_dotenv(env_path, override=True)
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, max_age=86400)  # Let browsers cache preflights instead of an OPTIONS per frame
 
 # ===== USER USAGE TRACKING =====
 MONTHLY_LIMIT = 20  # Max agent responses per user per month
@@ -66,6 +77,15 @@ def init_db():
             updated_at TEXT
         )
     ''')
+    # Latest identify result per camera session (see SESSION IDENTITY)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS session_identity (
+            session_id TEXT PRIMARY KEY,
+            identity TEXT NOT NULL,
+            streak INTEGER DEFAULT 1,
+            updated_at REAL NOT NULL
+        )
+    ''')
     # Job history table
     c.execute('''
         CREATE TABLE IF NOT EXISTS job_history (
@@ -156,8 +176,1148 @@ def get_deepface():
         _deepface = DeepFace
     return _deepface
 
-# Current identified person (persists during session)
-current_identity = None
+# ===== SESSION IDENTITY =====
+# Who each camera session (X-Session-Id, see FRAME STORE) was last identified as.
+# Identities expire after IDENTITY_TTL seconds (the browser re-identifies well within
+# that) and are written to the usage database, so every worker process gives the same
+# answer; reads are served from a short-lived in-process cache. A repeat of the same
+# result (e.g. a tracked face) only bumps the in-memory copy - the database row is
+# rewritten when the name or confidence changes, or every IDENTITY_WRITE_INTERVAL to keep it alive.
+IDENTITY_TTL = float(os.getenv('IDENTITY_TTL', '180'))
+IDENTITY_MAX_SESSIONS = int(os.getenv('IDENTITY_MAX_SESSIONS', '1000'))
+IDENTITY_CACHE_SECONDS = 2.0  # How long a worker trusts its cached copy before re-reading the database
+IDENTITY_WRITE_INTERVAL = min(30.0, IDENTITY_TTL / 2)  # Max age of the database row for an unchanged identity
+
+class IdentityStore:
+    """
+    Session -> latest identify result ({"identity", "streak", "updated_at", "written_at"})
+    with expiry and a size bound
+    """
+
+    def __init__(self, db_path, ttl, max_sessions):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.cache = OrderedDict()  # session_id -> (record or None, read_at), least recently used first
+        self.lock = threading.RLock()
+        self.writes = 0
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def _cache_put(self, session_id, record, now):
+        with self.lock:
+            self.cache[session_id] = (record, now)
+            self.cache.move_to_end(session_id)
+            while len(self.cache) > self.max_sessions:
+                self.cache.popitem(last=False)
+
+    def set(self, session_id, identity):
+        """Record a session's identify result; repeated results for the same name extend its streak"""
+        now = time.time()
+        with self.lock:
+            # This worker's own recent write is authoritative - no database read per identify
+            cached = self.cache.get(session_id)
+            if cached and cached[0] and now - cached[0]["written_at"] < IDENTITY_WRITE_INTERVAL:
+                previous = cached[0]
+            else:
+                previous = self.get(session_id)
+            same = previous is not None and previous["identity"].get("name") == identity.get("name")
+            unchanged = same and (round(previous["identity"].get("confidence", 0), 2) ==
+                                  round(identity.get("confidence", 0), 2))
+            record = {"identity": identity, "streak": previous["streak"] + 1 if same else 1, "updated_at": now,
+                      "written_at": previous["written_at"] if unchanged else now}
+            if not unchanged or now - record["written_at"] >= IDENTITY_WRITE_INTERVAL:
+                record["written_at"] = now
+                self._write(session_id, record)
+            self._cache_put(session_id, record, now)
+        return record
+
+    def _write(self, session_id, record):
+        conn = self._connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO session_identity (session_id, identity, streak, updated_at) '
+                         'VALUES (?, ?, ?, ?)',
+                         (session_id, json.dumps(record["identity"]), record["streak"], record["written_at"]))
+            self.writes += 1
+            if self.writes % 100 == 0:
+                self._prune(conn, record["written_at"])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _prune(self, conn, now):
+        """Delete expired sessions and keep at most max_sessions rows"""
+        conn.execute('DELETE FROM session_identity WHERE updated_at < ?', (now - self.ttl,))
+        conn.execute('DELETE FROM session_identity WHERE session_id NOT IN '
+                     '(SELECT session_id FROM session_identity ORDER BY updated_at DESC LIMIT ?)',
+                     (self.max_sessions,))
+
+    def clear(self, session_id):
+        """Forget a session's identity (its camera went away)"""
+        with self.lock:
+            conn = self._connect()
+            try:
+                conn.execute('DELETE FROM session_identity WHERE session_id = ?', (session_id,))
+                conn.commit()
+            finally:
+                conn.close()
+            self._cache_put(session_id, None, time.time())
+
+    @staticmethod
+    def _record(row):
+        identity, streak, updated_at = row
+        return {"identity": json.loads(identity), "streak": streak, "updated_at": updated_at, "written_at": updated_at}
+
+    def get(self, session_id):
+        """A session's unexpired record, or None"""
+        now = time.time()
+        cached = self.cache.get(session_id)
+        if cached and now - cached[1] < IDENTITY_CACHE_SECONDS:
+            record = cached[0]
+        else:
+            conn = self._connect()
+            try:
+                row = conn.execute('SELECT identity, streak, updated_at FROM session_identity WHERE session_id = ?',
+                                   (session_id,)).fetchone()
+            finally:
+                conn.close()
+            record = self._record(row) if row else None
+            self._cache_put(session_id, record, now)
+        if record is None or now - record["updated_at"] > self.ttl:
+            return None
+        return record
+
+    def only_active(self):
+        """The record of the one session with an unexpired identity - None if there are none or several"""
+        conn = self._connect()
+        try:
+            rows = conn.execute('SELECT identity, streak, updated_at FROM session_identity WHERE updated_at >= ? '
+                                'ORDER BY updated_at DESC LIMIT 2', (time.time() - self.ttl,)).fetchall()
+        finally:
+            conn.close()
+        return self._record(rows[0]) if len(rows) == 1 else None
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            active = conn.execute('SELECT COUNT(*) FROM session_identity WHERE updated_at >= ?',
+                                  (time.time() - self.ttl,)).fetchone()[0]
+        finally:
+            conn.close()
+        return {"active_sessions": active, "ttl_seconds": self.ttl, "max_sessions": self.max_sessions}
+
+identity_store = IdentityStore(DB_PATH, IDENTITY_TTL, IDENTITY_MAX_SESSIONS)
+
+def request_identity():
+    """
+    Identity for the caller's camera session. Calls without a session (Hume webhooks)
+    get the identity of the single active session - never a guess between several.
+    """
+    session_id = get_session_id()
+    record = identity_store.get(session_id) if session_id else identity_store.only_active()
+    return record["identity"] if record else None
+
+# ===== FACE WORKER POOL =====
+# With FACE_WORKERS > 0, TensorFlow runs in dedicated worker processes instead of
+# the Flask process. Workers take jobs over a local queue, are capped in threads,
+# and are recycled after FACE_WORKER_MAX_TASKS jobs, when their RSS grows past
+# FACE_WORKER_MAX_RSS_MB, or when they crash - without restarting the server.
+# Matching stays in the server: it's one matrix multiply against the resident index.
+FACE_WORKERS = int(os.getenv('FACE_WORKERS', '0'))  # 0 = run DeepFace in-process
+FACE_WORKER_THREADS = int(os.getenv('FACE_WORKER_THREADS', '2'))  # TF threads per worker
+FACE_WORKER_MAX_TASKS = int(os.getenv('FACE_WORKER_MAX_TASKS', '500'))
+FACE_WORKER_MAX_RSS_MB = int(os.getenv('FACE_WORKER_MAX_RSS_MB', '2048'))
+FACE_WORKER_TIMEOUT = float(os.getenv('FACE_WORKER_TIMEOUT', '60'))  # Seconds per job, from dispatch
+FACE_WORKER_QUEUE_TIMEOUT = float(os.getenv('FACE_WORKER_QUEUE_TIMEOUT', '30'))  # Seconds to wait for an idle worker
+
+def face_worker_main(worker_id, tasks, results, max_tasks, max_rss_mb, threads):
+    """
+    Worker process loop: load the model, report ready, then serve jobs until told
+    to stop or until it's time to retire (too many jobs / too much memory).
+    """
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+
+    ops = {
+        'embed': lambda img, detector='opencv': [{**face, "embedding": np.asarray(face['embedding'], dtype=np.float32)}
+                                                 for face in embed_face_image_local(img, detector)],
+        'crop': lambda img: prepare_face_crop_local(img),
+        'embed_batch': lambda imgs: [[{**face, "embedding": np.asarray(face['embedding'], dtype=np.float32)}
+                                      for face in faces] for faces in embed_face_images_local(imgs)]
+    }
+
+    # Warm up before taking jobs, so recycled workers come back ready
+    get_deepface().build_model(FACE_MODEL_NAME)
+    embed_face_image_local(np.zeros((224, 224, 3), dtype=np.uint8))
+    results.put((worker_id, None, True, "ready", False))
+
+    proc = psutil.Process()
+    completed = 0
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job_id, op, args = task
+        try:
+            ok, value = True, ops[op](*args)
+        except Exception as e:
+            ok, value = False, f"{type(e).__name__}: {e}"
+        completed += 1
+        retire = completed >= max_tasks or proc.memory_info().rss > max_rss_mb * 1024 * 1024
+        results.put((worker_id, job_id, ok, value, retire))
+        if retire:
+            break
+
+class FaceWorkerPool:
+    """Fixed-size pool of face recognition processes fed over local queues"""
+
+    def __init__(self, size):
+        self.ctx = multiprocessing.get_context('spawn')  # Never fork a threaded Flask process
+        self.size = size
+        self.results = self.ctx.Queue()
+        self.workers = {}  # worker_id -> {"process", "tasks", "job", "ready", "completed", "started_at"}
+        self.idle = []  # Ready worker ids with no job
+        self.jobs = {}  # job_id -> {"event", "ok", "value"}
+        self.job_ids = itertools.count(1)
+        self.recycled = 0
+        self.respawn_at = {}  # worker_id -> time to retry a worker that failed to start
+        self.cond = threading.Condition()
+        with self.cond:
+            for worker_id in range(size):
+                self._spawn(worker_id)
+        threading.Thread(target=self._collect, name="face-pool-collector", daemon=True).start()
+
+    def _spawn(self, worker_id):
+        """Start a worker process in a slot (caller holds the lock)"""
+        tasks = self.ctx.Queue()
+        process = self.ctx.Process(
+            target=face_worker_main,
+            args=(worker_id, tasks, self.results, FACE_WORKER_MAX_TASKS, FACE_WORKER_MAX_RSS_MB, FACE_WORKER_THREADS),
+            name=f"face-worker-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        self.workers[worker_id] = {
+            "process": process,
+            "tasks": tasks,
+            "job": None,
+            "ready": False,
+            "completed": 0,
+            "started_at": time.time()
+        }
+
+    def _replace(self, worker_id, reason):
+        """
+        Fail the worker's in-flight job and start a fresh one in its slot (caller holds
+        the lock). Returns the old process for the caller to _reap once it has released the lock.
+        """
+        worker = self.workers.pop(worker_id)
+        if worker_id in self.idle:
+            self.idle.remove(worker_id)
+        job = self.jobs.pop(worker["job"], None)
+        if job:
+            job["value"] = f"face worker {reason}"
+            job["event"].set()
+        process = worker["process"]
+        self.recycled += 1
+        if worker["ready"]:
+            print(f"Face worker {worker_id} (pid {process.pid}) {reason}, restarting")
+            self._spawn(worker_id)
+        else:
+            # Died while loading the model - back off instead of crash-looping
+            print(f"Face worker {worker_id} (pid {process.pid}) {reason} before it was ready, retrying in 30s")
+            self.respawn_at[worker_id] = time.time() + 30
+        return process
+
+    @staticmethod
+    def _reap(process, kill=False):
+        """Wait for a replaced worker process to exit, killing it if it doesn't (never under the lock)"""
+        if kill:
+            process.kill()
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def _collect(self):
+        """Route results back to waiting requests and keep the pool at full size"""
+        while True:
+            try:
+                worker_id, job_id, ok, value, retire = self.results.get(timeout=1.0)
+            except queue.Empty:
+                replaced = []
+                with self.cond:
+                    for worker_id, worker in list(self.workers.items()):
+                        if not worker["process"].is_alive():
+                            replaced.append(self._replace(worker_id, f"exited with code {worker['process'].exitcode}"))
+                    for worker_id, due in list(self.respawn_at.items()):
+                        if due <= time.time():
+                            del self.respawn_at[worker_id]
+                            self._spawn(worker_id)
+                for process in replaced:
+                    self._reap(process)
+                continue
+
+            retired = None
+            with self.cond:
+                job = self.jobs.pop(job_id, None)
+                if job:
+                    job["ok"], job["value"] = ok, value
+                    job["event"].set()
+
+                worker = self.workers.get(worker_id)
+                if not worker or worker["job"] != job_id:
+                    continue  # Stale result from a worker that was already replaced
+                worker["job"] = None
+                if job_id is None:
+                    worker["ready"] = True
+                else:
+                    worker["completed"] += 1
+                if retire:
+                    retired = self._replace(worker_id, "retired")
+                else:
+                    self.idle.append(worker_id)
+                # Wake every waiter: submit() wants an idle worker, wait_ready() a ready one
+                self.cond.notify_all()
+            if retired:
+                self._reap(retired)
+
+    def submit(self, op, *args, timeout=FACE_WORKER_TIMEOUT, queue_timeout=FACE_WORKER_QUEUE_TIMEOUT):
+        """
+        Run a job on the next idle worker and wait for its result. Waiting for a worker is
+        bounded by queue_timeout; the job's own timeout starts once it is dispatched, so a
+        backlog never makes a healthy worker look hung.
+        """
+        queue_deadline = time.time() + queue_timeout
+        job = {"event": threading.Event(), "ok": False, "value": None}
+        with self.cond:
+            while not self.idle:
+                remaining = queue_deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError("No face worker available")
+                self.cond.wait(remaining)
+            worker_id = self.idle.pop()
+            job_id = next(self.job_ids)
+            self.jobs[job_id] = job
+            self.workers[worker_id]["job"] = job_id
+            self.workers[worker_id]["tasks"].put((job_id, op, args))
+
+        if not job["event"].wait(timeout):
+            hung = None
+            with self.cond:
+                worker = self.workers.get(worker_id)
+                if worker and worker["job"] == job_id:
+                    hung = self._replace(worker_id, "timed out")
+            if hung:
+                self._reap(hung, kill=True)
+            raise TimeoutError(f"Face worker job '{op}' timed out")
+        if not job["ok"]:
+            raise RuntimeError(job["value"])
+        return job["value"]
+
+    def wait_ready(self, timeout=300):
+        """Block until every running worker (and at least one) has loaded its model"""
+        deadline = time.time() + timeout
+        with self.cond:
+            while not (self.workers and all(w["ready"] for w in self.workers.values())):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError("Face workers did not become ready")
+                self.cond.wait(remaining)
+
+    def status(self):
+        """Per-worker status for the readiness endpoint"""
+        workers = []
+        with self.cond:
+            for worker_id, worker in sorted(self.workers.items()):
+                try:
+                    rss_mb = round(psutil.Process(worker["process"].pid).memory_info().rss / (1024**2), 1)
+                except (psutil.NoSuchProcess, TypeError):
+                    rss_mb = None
+                workers.append({
+                    "id": worker_id,
+                    "pid": worker["process"].pid,
+                    "ready": worker["ready"],
+                    "busy": worker["job"] is not None,
+                    "completed": worker["completed"],
+                    "rss_mb": rss_mb
+                })
+        return {"size": self.size, "recycled": self.recycled, "workers": workers}
+
+_face_pool = None
+_face_pool_lock = threading.Lock()
+
+def get_face_pool():
+    """Get the face worker pool, starting it on first use (None when FACE_WORKERS=0)"""
+    global _face_pool
+    if FACE_WORKERS <= 0:
+        return None
+    if _face_pool is None:
+        with _face_pool_lock:
+            if _face_pool is None:
+                _face_pool = FaceWorkerPool(FACE_WORKERS)
+    return _face_pool
+
+# ===== ENROLLMENT PHOTO NORMALIZATION =====
+# Enrollment photos are downscaled before they're stored, and the face is detected
+# and aligned once into a small square crop under known_faces/<name>/crops/.
+# Index builds embed the crop directly (no detection, tiny image).
+FACE_PHOTO_MAX_EDGE = int(os.getenv('FACE_PHOTO_MAX_EDGE', '640'))  # Stored photo long edge (px)
+FACE_CROP_SIZE = 224  # Aligned face crop size (VGG-Face input)
+FACE_CROPS_DIRNAME = 'crops'
+
+def face_crop_path(photo):
+    """Where the aligned face crop for an enrollment photo lives"""
+    return photo.parent / FACE_CROPS_DIRNAME / photo.name
+
+def save_enrollment_photo(image_bytes, photo):
+    """Store an uploaded enrollment photo as a JPEG no larger than FACE_PHOTO_MAX_EDGE"""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img = img.convert('RGB')
+        img.thumbnail((FACE_PHOTO_MAX_EDGE, FACE_PHOTO_MAX_EDGE), Image.LANCZOS)
+        img.save(photo, 'JPEG', quality=90)
+
+def prepare_face_crop_local(img):
+    """
+    Detect and align the largest face in an image and return it as a
+    FACE_CROP_SIZE square BGR uint8 array, or None if no face is found.
+    """
+    DeepFace = get_deepface()
+    faces = DeepFace.extract_faces(img_path=img, detector_backend='opencv', enforce_detection=False, align=True)
+    # With enforce_detection=False, "no face" comes back as the whole image with confidence 0
+    faces = [f for f in faces if f.get('confidence', 0) > 0]
+    if not faces:
+        return None
+    face = max(faces, key=lambda f: f['facial_area']['w'] * f['facial_area']['h'])['face']
+
+    rgb = Image.fromarray((np.clip(face, 0, 1) * 255).astype(np.uint8))
+    # Pad to a square (keeps the aspect ratio, like DeepFace's own resize), then scale
+    side = max(rgb.size)
+    square = Image.new('RGB', (side, side))
+    square.paste(rgb, ((side - rgb.width) // 2, (side - rgb.height) // 2))
+    square = square.resize((FACE_CROP_SIZE, FACE_CROP_SIZE), Image.LANCZOS)
+    return np.ascontiguousarray(np.asarray(square)[:, :, ::-1])
+
+def prepare_face_crop(img):
+    """Detect + align a face crop, on the worker pool if one is configured"""
+    pool = get_face_pool()
+    if pool:
+        return pool.submit('crop', img)
+    return prepare_face_crop_local(img)
+
+def save_face_crop(photo):
+    """Create the aligned face crop for an enrollment photo. Returns False if no face was found"""
+    crop_path = face_crop_path(photo)
+    # Drop any crop from an older photo at this path first, so a failed crop can't leave it behind
+    crop_path.unlink(missing_ok=True)
+    crop = prepare_face_crop(decode_image(photo.read_bytes()))
+    if crop is None:
+        return False
+    crop_path.parent.mkdir(exist_ok=True)
+    Image.fromarray(crop[:, :, ::-1]).save(crop_path, 'JPEG', quality=95)
+    return True
+
+# ===== FACE EMBEDDING INDEX =====
+# Known-face embeddings stay resident in memory so /api/identify costs one
+# embedding plus one matrix multiply, instead of a DeepFace.find() scan per frame.
+# The index is persisted next to the photos (one file per model key) and maintained
+# incrementally: enrolling or deleting a photo only touches that photo's embedding.
+FACE_PHOTO_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+FACE_INDEX_VERSION = 2  # Bump when the embedding pipeline changes to force a rebuild
+
+# Supported face models (DeepFace backends) with their cosine distance thresholds.
+# confidence_scale is the distance at which reported confidence drops to 0%.
+# Compare them on our own faces with: python3 bench_face_models.py
+FACE_MODELS = {
+    'VGG-Face': {"threshold": 0.40, "confidence_scale": 0.60, "dims": 4096},
+    'Facenet': {"threshold": 0.40, "confidence_scale": 0.60, "dims": 128},
+    'Facenet512': {"threshold": 0.30, "confidence_scale": 0.45, "dims": 512},
+    'ArcFace': {"threshold": 0.68, "confidence_scale": 1.00, "dims": 512},
+    'SFace': {"threshold": 0.593, "confidence_scale": 0.90, "dims": 128},
+    'GhostFaceNet': {"threshold": 0.65, "confidence_scale": 1.00, "dims": 512},
+    'OpenFace': {"threshold": 0.10, "confidence_scale": 0.15, "dims": 128},
+    'Dlib': {"threshold": 0.07, "confidence_scale": 0.10, "dims": 128}
+}
+FACE_MODEL_NAME = os.getenv('FACE_MODEL', 'VGG-Face')
+if FACE_MODEL_NAME not in FACE_MODELS:
+    raise ValueError(f"Unknown FACE_MODEL '{FACE_MODEL_NAME}' (choose from {', '.join(FACE_MODELS)})")
+FACE_MATCH_THRESHOLD = float(os.getenv('FACE_MATCH_THRESHOLD', FACE_MODELS[FACE_MODEL_NAME]["threshold"]))
+FACE_CONFIDENCE_SCALE = FACE_MODELS[FACE_MODEL_NAME]["confidence_scale"]
+FACE_EMBEDDING_DIMS = FACE_MODELS[FACE_MODEL_NAME]["dims"]
+
+def face_model_key(model_name):
+    """Model + pipeline version key - embeddings from different keys never mix"""
+    slug = ''.join(c if c.isalnum() else '_' for c in model_name.lower())
+    return f"{slug}_v{FACE_INDEX_VERSION}"
+
+FACE_INDEX_FILE = KNOWN_FACES_DIR / f"face_index_{face_model_key(FACE_MODEL_NAME)}.npz"
+
+# Replaced as a whole on every change, so readers always see a consistent snapshot
+_face_index = None
+_face_index_lock = threading.RLock()
+
+def embed_face_image_local(img, detector='opencv', model_name=None):
+    """
+    Run face detection + embedding on an image (file path or BGR array) in this process.
+    Use detector='skip' for images that are already an aligned face crop.
+    Returns DeepFace.represent() results: [{"embedding", "facial_area", "face_confidence"}, ...]
+    """
+    DeepFace = get_deepface()
+    return DeepFace.represent(
+        img_path=img,
+        model_name=model_name or FACE_MODEL_NAME,
+        detector_backend=detector,
+        enforce_detection=False
+    )
+
+def embed_face_image(img, detector='opencv'):
+    """Embed faces in an image, on the worker pool if one is configured"""
+    pool = get_face_pool()
+    if pool:
+        return pool.submit('embed', img, detector)
+    return embed_face_image_local(img, detector)
+
+def embed_face_images_local(imgs):
+    """
+    Embed the faces in several images with one batched model call: DeepFace detects
+    faces per image, then runs every crop through the model in a single forward pass.
+    Returns one list of faces per image.
+    """
+    DeepFace = get_deepface()
+    results = DeepFace.represent(
+        img_path=list(imgs),
+        model_name=FACE_MODEL_NAME,
+        enforce_detection=False
+    )
+    # DeepFace unwraps the result for a single-image batch
+    if results and isinstance(results[0], dict):
+        return [results]
+    return results
+
+def embed_face_images(imgs):
+    """Batched embed_face_image(), on the worker pool if one is configured"""
+    pool = get_face_pool()
+    if pool:
+        return pool.submit('embed_batch', imgs)
+    return embed_face_images_local(imgs)
+
+def decode_image(image_bytes):
+    """Decode JPEG/PNG bytes into a BGR NumPy array (the layout DeepFace expects)"""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        rgb = np.asarray(img.convert('RGB'))
+    return np.ascontiguousarray(rgb[:, :, ::-1])
+
+def normalize_embedding(embedding):
+    """L2-normalize an embedding so cosine distance is 1 - dot product"""
+    vec = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
+
+def list_known_photos():
+    """Yield (person_name, photo_path) for every photo in known_faces"""
+    for person_dir in sorted(KNOWN_FACES_DIR.iterdir()):
+        if not person_dir.is_dir():
+            continue
+        for photo in sorted(person_dir.iterdir()):
+            if photo.is_file() and photo.suffix.lower() in FACE_PHOTO_EXTENSIONS:
+                yield person_dir.name, photo
+
+def make_face_index(embeddings, labels, paths, mtimes, ivf=None, prototypes=None):
+    """Build an index snapshot from parallel row data"""
+    return {
+        "embeddings": embeddings if len(labels) else None,  # (N, D) float32, L2-normalized rows
+        "labels": list(labels),  # person name per row
+        "paths": list(paths),  # photo path relative to known_faces, per row
+        "mtimes": list(mtimes),  # photo mtime when it was embedded, per row
+        "ivf": ivf,  # ANN lists for large indexes, built on first search (see get_face_ivf)
+        "prototypes": prototypes,  # Per-person prototypes in prototype match mode (see get_face_prototypes)
+        "file_id": None,  # face_index_file_id() of the index file this snapshot matches
+        "built_at": time.time()
+    }
+
+def face_index_file_id():
+    """(inode, mtime, size) of the persisted index, or None - changes whenever any process saves it"""
+    try:
+        st = os.stat(FACE_INDEX_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def embed_known_photo(photo):
+    """
+    Embed one enrollment photo from its aligned face crop (creating the crop if it's
+    missing or older than the photo). Returns the normalized embedding or None.
+    """
+    try:
+        crop_path = face_crop_path(photo)
+        if not crop_path.exists() or crop_path.stat().st_mtime < photo.stat().st_mtime:
+            save_face_crop(photo)
+        if crop_path.exists():
+            faces = embed_face_image(decode_image(crop_path.read_bytes()), detector='skip')
+        else:
+            # No face found when cropping - fall back to detecting on the full photo
+            faces = embed_face_image(decode_image(photo.read_bytes()))
+    except Exception as e:
+        print(f"Face index: skipping {photo}: {e}")
+        return None
+    if not faces:
+        return None
+    return normalize_embedding(faces[0]['embedding'])
+
+def load_face_index_file():
+    """Load the persisted index, or None if it's missing or from another pipeline version"""
+    if not FACE_INDEX_FILE.exists():
+        return None
+    try:
+        with np.load(FACE_INDEX_FILE, allow_pickle=False) as data:
+            if str(data['key']) != face_model_key(FACE_MODEL_NAME):
+                print("Face index: stored index is from another model/version, rebuilding")
+                return None
+            if len(data['labels']) and data['embeddings'].shape[1] != FACE_EMBEDDING_DIMS:
+                print(f"Face index: stored embeddings are {data['embeddings'].shape[1]}-d, "
+                      f"{FACE_MODEL_NAME} gives {FACE_EMBEDDING_DIMS}-d, rebuilding")
+                return None
+            return make_face_index(
+                data['embeddings'].astype(np.float32),
+                [str(x) for x in data['labels']],
+                [str(x) for x in data['paths']],
+                [float(x) for x in data['mtimes']]
+            )
+    except Exception as e:
+        print(f"Face index: could not load {FACE_INDEX_FILE}: {e}")
+        return None
+
+def save_face_index_file(index):
+    """Persist the index atomically (write a temp file, then rename over the old one)"""
+    embeddings = index["embeddings"] if index["embeddings"] is not None else np.zeros((0, 0), dtype=np.float32)
+    fd, tmp_path = tempfile.mkstemp(dir=KNOWN_FACES_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(
+                f,
+                key=face_model_key(FACE_MODEL_NAME),
+                embeddings=embeddings,
+                labels=np.array(index["labels"], dtype=str),
+                paths=np.array(index["paths"], dtype=str),
+                mtimes=np.array(index["mtimes"], dtype=np.float64)
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, FACE_INDEX_FILE)
+        index["file_id"] = face_index_file_id()
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def sync_face_index(index):
+    """
+    Reconcile an index with the photos on disk: drop rows for deleted photos and
+    embed only photos that are new or changed. Returns (index, changed).
+    """
+    on_disk = {}
+    for name, photo in list_known_photos():
+        on_disk[str(photo.relative_to(KNOWN_FACES_DIR))] = (name, photo.stat().st_mtime)
+
+    keep = [i for i, (path, mtime) in enumerate(zip(index["paths"], index["mtimes"]))
+            if path in on_disk and on_disk[path][1] == mtime]
+    changed = len(keep) != len(index["paths"])
+
+    embeddings = [index["embeddings"][keep]] if keep else []
+    labels = [index["labels"][i] for i in keep]
+    paths = [index["paths"][i] for i in keep]
+    mtimes = [index["mtimes"][i] for i in keep]
+
+    known = set(paths)
+    for path, (name, mtime) in on_disk.items():
+        if path in known:
+            continue
+        changed = True
+        vec = embed_known_photo(KNOWN_FACES_DIR / path)
+        if vec is None:
+            continue
+        embeddings.append(vec[None, :])
+        labels.append(name)
+        paths.append(path)
+        mtimes.append(mtime)
+
+    if not changed:
+        return index, False
+    matrix = np.vstack(embeddings) if labels else None
+    return make_face_index(matrix, labels, paths, mtimes), True
+
+def build_face_index():
+    """Load the persisted index and bring it up to date with known_faces"""
+    start = time.time()
+    file_id = face_index_file_id()  # Before loading: a save racing the load triggers another reload
+    index = load_face_index_file() or make_face_index(None, [], [], [])
+    index, changed = sync_face_index(index)
+    if changed:
+        save_face_index_file(index)
+    else:
+        index["file_id"] = file_id
+    if FACE_MATCH_MODE == 'prototype':
+        get_face_prototypes(index)
+    else:
+        get_face_ivf(index)  # Train ANN lists up front for large indexes
+    print(f"Face index ready: {len(index['labels'])} photos in {time.time() - start:.1f}s")
+    return index
+
+def get_face_index():
+    """
+    Get the resident face index, loading it on first use - and again when another
+    worker process has saved the index file (enrolled or deleted a face) since
+    """
+    global _face_index
+    if _face_index is None:
+        with _face_index_lock:
+            if _face_index is None:
+                _face_index = build_face_index()
+    elif face_index_file_id() != _face_index["file_id"]:
+        with _face_index_lock:
+            if face_index_file_id() != _face_index["file_id"]:
+                print("Face index: index file changed on disk, reloading")
+                _face_index = build_face_index()
+                clear_face_track()
+    return _face_index
+
+def face_index_add_photo(photo):
+    """Embed a newly enrolled photo and add just that row to the index"""
+    global _face_index
+    with _face_index_lock:
+        index = get_face_index()
+        path = str(photo.relative_to(KNOWN_FACES_DIR))
+        mtime = photo.stat().st_mtime
+        if path in index["paths"] and index["mtimes"][index["paths"].index(path)] == mtime:
+            return  # Already picked up when the index was loaded
+
+        vec = embed_known_photo(photo)
+        keep = [i for i, p in enumerate(index["paths"]) if p != path]
+        rows = index["embeddings"][keep] if keep else None
+        labels = [index["labels"][i] for i in keep]
+        paths = [index["paths"][i] for i in keep]
+        mtimes = [index["mtimes"][i] for i in keep]
+        if vec is not None:
+            rows = vec[None, :] if rows is None else np.vstack([rows, vec[None, :]])
+            labels.append(photo.parent.name)
+            paths.append(path)
+            mtimes.append(mtime)
+
+        _face_index = make_face_index(rows, labels, paths, mtimes,
+                                      ivf=update_face_ivf(index["ivf"], keep, None if vec is None else vec[None, :]))
+        if index["prototypes"] is not None:
+            _face_index["prototypes"] = build_face_prototypes(_face_index, index["prototypes"], {photo.parent.name})
+        save_face_index_file(_face_index)
+        clear_face_track()
+
+def face_index_remove(name, filename=None):
+    """Remove one photo's row (or all of a person's rows) from the index"""
+    global _face_index
+    with _face_index_lock:
+        index = get_face_index()
+        keep = [i for i, (label, path) in enumerate(zip(index["labels"], index["paths"]))
+                if not (label == name and (filename is None or Path(path).name == filename))]
+        if len(keep) == len(index["labels"]):
+            return
+
+        _face_index = make_face_index(
+            index["embeddings"][keep] if keep else None,
+            [index["labels"][i] for i in keep],
+            [index["paths"][i] for i in keep],
+            [index["mtimes"][i] for i in keep],
+            ivf=update_face_ivf(index["ivf"], keep, None)
+        )
+        if index["prototypes"] is not None:
+            _face_index["prototypes"] = build_face_prototypes(_face_index, index["prototypes"], {name})
+        save_face_index_file(_face_index)
+        clear_face_track()
+
+# ===== APPROXIMATE NEAREST-NEIGHBOUR SEARCH =====
+# Exact matching scans every stored photo, which is fine for a handful of people.
+# Once the index holds FACE_ANN_MIN_SIZE photos we switch to an IVF index: rows are
+# clustered around ~sqrt(N) centroids (spherical k-means) and a query only scans
+# the FACE_ANN_NPROBE closest clusters. Higher nprobe = better recall, more latency.
+# Benchmark with: python3 bench_face_index.py
+FACE_ANN_MIN_SIZE = int(os.getenv('FACE_ANN_MIN_SIZE', '2000'))  # Below this, always exact
+FACE_ANN_NPROBE = int(os.getenv('FACE_ANN_NPROBE', '8'))  # Clusters scanned per query
+FACE_ANN_LISTS = int(os.getenv('FACE_ANN_LISTS', '0'))  # Number of clusters (0 = sqrt(N))
+FACE_ANN_TRAIN_ITERATIONS = 10
+FACE_ANN_TRAIN_SAMPLE = 64  # k-means training rows per cluster
+
+_face_ivf_lock = threading.Lock()
+
+def assign_ivf_lists(centroids, rows, chunk=8192):
+    """Nearest centroid (by cosine) for each row, in chunks to bound memory"""
+    assignments = np.empty(len(rows), dtype=np.int32)
+    for start in range(0, len(rows), chunk):
+        assignments[start:start + chunk] = np.argmax(rows[start:start + chunk] @ centroids.T, axis=1)
+    return assignments
+
+def make_ivf(centroids, assignments, trained_size):
+    """Group row ids by cluster: rows of cluster c are order[offsets[c]:offsets[c + 1]]"""
+    order = np.argsort(assignments, kind='stable')
+    offsets = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+    return {
+        "centroids": centroids,
+        "assignments": assignments,
+        "order": order,
+        "offsets": offsets,
+        "trained_size": trained_size  # Retrain once the index doubles or halves
+    }
+
+def train_ivf(embeddings, n_lists=None, seed=0):
+    """Spherical k-means over a sample of the rows, then assign every row to a cluster"""
+    n = len(embeddings)
+    n_lists = min(n, n_lists or FACE_ANN_LISTS or max(1, int(np.sqrt(n))))
+    rng = np.random.default_rng(seed)
+    sample = embeddings[np.sort(rng.choice(n, size=min(n, n_lists * FACE_ANN_TRAIN_SAMPLE), replace=False))]
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+
+    for _ in range(FACE_ANN_TRAIN_ITERATIONS):
+        assignments = assign_ivf_lists(centroids, sample)
+        counts = np.bincount(assignments, minlength=n_lists)
+        order = np.argsort(assignments, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        filled = counts > 0
+        centroids[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+        # Re-seed empty clusters from random sample rows
+        centroids[~filled] = sample[rng.choice(len(sample), size=int((~filled).sum()))]
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    return make_ivf(centroids, assign_ivf_lists(centroids, embeddings), n)
+
+def update_face_ivf(ivf, keep, added):
+    """
+    Carry IVF lists over to a new index snapshot: keep rows `keep` (old row ids) and
+    append `added` rows to their nearest clusters. Returns None to retrain lazily.
+    """
+    if ivf is None:
+        return None
+    assignments = ivf["assignments"][np.asarray(keep, dtype=np.int64)]
+    if added is not None:
+        assignments = np.concatenate([assignments, assign_ivf_lists(ivf["centroids"], added)])
+    n = len(assignments)
+    if n < FACE_ANN_MIN_SIZE or n > 2 * ivf["trained_size"] or 2 * n < ivf["trained_size"]:
+        return None
+    return make_ivf(ivf["centroids"], assignments, ivf["trained_size"])
+
+def get_face_ivf(index):
+    """IVF lists for a large index (trained on first use), or None for exact search"""
+    if index["ivf"] is not None:
+        return index["ivf"]
+    if index["embeddings"] is None or len(index["labels"]) < FACE_ANN_MIN_SIZE:
+        return None
+    if index["ivf"] is None:
+        with _face_ivf_lock:
+            if index["ivf"] is None:
+                start = time.time()
+                index["ivf"] = train_ivf(index["embeddings"])
+                print(f"Face index: trained {len(index['ivf']['centroids'])} ANN lists "
+                      f"over {len(index['labels'])} photos in {time.time() - start:.1f}s")
+    return index["ivf"]
+
+def search_index(index, embedding, nprobe=None, exact=False):
+    """
+    Find the nearest row of an index by cosine distance.
+    Returns (person_name, photo_path, distance) or None if the index is empty.
+    """
+    if index["embeddings"] is None:
+        return None
+    query = normalize_embedding(embedding)
+
+    ivf = None if exact else get_face_ivf(index)
+    if ivf is not None:
+        scores = ivf["centroids"] @ query
+        nprobe = min(nprobe or FACE_ANN_NPROBE, len(scores))
+        probe = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        rows = np.concatenate([ivf["order"][ivf["offsets"][c]:ivf["offsets"][c + 1]] for c in probe])
+        if len(rows):
+            distances = 1.0 - index["embeddings"][rows] @ query
+            best = int(np.argmin(distances))
+            row = int(rows[best])
+            return index["labels"][row], index["paths"][row], float(distances[best])
+
+    # Exact search: one vectorized pass over every row
+    distances = 1.0 - index["embeddings"] @ query
+    best = int(np.argmin(distances))
+    return index["labels"][best], index["paths"][best], float(distances[best])
+
+# ===== PER-PERSON PROTOTYPES =====
+# In prototype mode (FACE_MATCH_MODE=prototype) each person is summarized by a
+# centroid (FACE_PROTOTYPES_PER_PERSON=1) or a few k-medoid photos. A query is
+# matched against prototypes first, then re-ranked against the raw photos of only
+# the FACE_PROTOTYPE_CANDIDATES closest people - so cost scales with people, not photos.
+FACE_MATCH_MODE = os.getenv('FACE_MATCH_MODE', 'raw')  # raw | prototype
+FACE_PROTOTYPES_PER_PERSON = int(os.getenv('FACE_PROTOTYPES_PER_PERSON', '1'))
+FACE_PROTOTYPE_CANDIDATES = int(os.getenv('FACE_PROTOTYPE_CANDIDATES', '3'))
+
+_face_prototypes_lock = threading.Lock()
+
+def k_medoids(rows, k, iterations=10):
+    """Pick k representative rows (by cosine distance) - small k-medoids for one person's photos"""
+    distances = 1.0 - rows @ rows.T
+    # Start from the most central photo, then greedily add the farthest ones
+    medoids = [int(np.argmin(distances.sum(axis=1)))]
+    while len(medoids) < k:
+        medoids.append(int(np.argmax(distances[:, medoids].min(axis=1))))
+
+    for _ in range(iterations):
+        assignments = np.argmin(distances[:, medoids], axis=1)
+        updated = []
+        for cluster in range(k):
+            members = np.flatnonzero(assignments == cluster)
+            if len(members) == 0:
+                updated.append(medoids[cluster])
+                continue
+            within = distances[np.ix_(members, members)].sum(axis=1)
+            updated.append(int(members[np.argmin(within)]))
+        if updated == medoids:
+            break
+        medoids = updated
+    return rows[medoids]
+
+def person_prototypes(rows, k=None):
+    """Prototype embeddings for one person's photo rows"""
+    k = k or FACE_PROTOTYPES_PER_PERSON
+    if k <= 1:
+        return normalize_embedding(rows.mean(axis=0))[None, :]
+    if len(rows) <= k:
+        return rows
+    return k_medoids(rows, k)
+
+def build_face_prototypes(index, previous=None, changed=(), k=None):
+    """
+    Prototypes for every person in an index. People not in `changed` reuse their
+    prototypes from `previous`, so an enrollment only recomputes one person.
+    """
+    person_rows = {}
+    for row, label in enumerate(index["labels"]):
+        person_rows.setdefault(label, []).append(row)
+    person_rows = {name: np.array(rows) for name, rows in person_rows.items()}
+
+    by_person = {}
+    for name, rows in person_rows.items():
+        if previous and name not in changed and name in previous["by_person"]:
+            by_person[name] = previous["by_person"][name]
+        else:
+            by_person[name] = person_prototypes(index["embeddings"][rows], k)
+
+    names = sorted(by_person)
+    counts = [len(by_person[name]) for name in names]
+    return {
+        "by_person": by_person,  # name -> (k, D) prototypes
+        "rows": person_rows,  # name -> row ids of that person's photos
+        "names": names,
+        "starts": np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64),  # First prototype row per name
+        "embeddings": np.vstack([by_person[name] for name in names]) if names else None
+    }
+
+def get_face_prototypes(index):
+    """Per-person prototypes for an index (built on first use)"""
+    if index["prototypes"] is None and index["embeddings"] is not None:
+        with _face_prototypes_lock:
+            if index["prototypes"] is None:
+                index["prototypes"] = build_face_prototypes(index)
+    return index["prototypes"]
+
+def search_prototypes(index, embedding, candidates=None):
+    """
+    Match against per-person prototypes, then re-rank the raw photos of the closest
+    people exactly. Returns (person_name, photo_path, distance) or None.
+    """
+    prototypes = get_face_prototypes(index)
+    if prototypes is None or prototypes["embeddings"] is None:
+        return None
+    query = normalize_embedding(embedding)
+
+    # Closest prototype per person, then the best few people
+    person_scores = np.maximum.reduceat(prototypes["embeddings"] @ query, prototypes["starts"])
+    count = min(candidates or FACE_PROTOTYPE_CANDIDATES, len(person_scores))
+    people = np.argpartition(-person_scores, count - 1)[:count]
+
+    rows = np.concatenate([prototypes["rows"][prototypes["names"][p]] for p in people])
+    distances = 1.0 - index["embeddings"][rows] @ query
+    best = int(np.argmin(distances))
+    row = int(rows[best])
+    return index["labels"][row], index["paths"][row], float(distances[best])
+
+def search_face_index(embedding):
+    """Find the nearest known face in the resident index"""
+    index = get_face_index()
+    if FACE_MATCH_MODE == 'prototype':
+        return search_prototypes(index, embedding)
+    return search_index(index, embedding)
+
+def match_face(embedding):
+    """Match one face embedding against the index and build its identity result"""
+    match = search_face_index(embedding)
+    if not match:
+        return {"name": "unknown", "confidence": 0, "message": "Face detected but not recognized"}
+
+    # Best match (lowest distance) from the resident index
+    person_name, identity_path, distance = match
+
+    # Threshold and confidence scale depend on the configured model (see FACE_MODELS)
+    confidence = max(0, (1 - distance / FACE_CONFIDENCE_SCALE)) * 100
+
+    if distance < FACE_MATCH_THRESHOLD:
+        return {
+            "name": person_name,
+            "confidence": round(confidence, 1),
+            "message": f"Identified as {person_name}"
+        }
+    return {
+        "name": "unknown",
+        "confidence": round(confidence, 1),
+        "message": "Face detected but not recognized"
+    }
+
+# ===== FACE TRACKING CACHE =====
+# While the same person sits still in front of the camera, identify doesn't need
+# to re-run detection + embedding. We remember the last face box and a tiny
+# grayscale thumbnail of it; if the new frame still shows (nearly) the same
+# thing at that spot, the cached identity is reused until FACE_TRACK_TTL expires.
+FACE_TRACK_TTL = float(os.getenv('FACE_TRACK_TTL', '10'))  # Seconds before forcing a full re-identify
+FACE_TRACK_MAX_DIFF = float(os.getenv('FACE_TRACK_MAX_DIFF', '0.04'))  # Mean abs signature difference (0-1)
+FACE_SIGNATURE_SIZE = 16  # Signature thumbnail is 16x16 grayscale
+
+# Per camera session:
+# {"box": (x, y, w, h), "frame_size": (h, w), "signature": array, "identity": dict, "at": timestamp}
+_face_tracks = {}
+
+def face_signature(frame, box):
+    """Cheap appearance signature of a face box: a mean-centered grayscale thumbnail"""
+    x, y, w, h = box
+    crop = frame[y:y + h, x:x + w]
+    if crop.size == 0:
+        return None
+    gray = Image.fromarray(crop.mean(axis=2).astype(np.uint8))
+    thumb = np.asarray(gray.resize((FACE_SIGNATURE_SIZE, FACE_SIGNATURE_SIZE), Image.BILINEAR), dtype=np.float32) / 255
+    return thumb - thumb.mean()  # Ignore overall brightness shifts
+
+def lookup_face_track(frame, session_id):
+    """Return the session's cached identity if the tracked face is still there, else None"""
+    track = _face_tracks.get(session_id)
+    if not track or time.time() - track["at"] > FACE_TRACK_TTL:
+        return None
+    if frame.shape[:2] != track["frame_size"]:
+        return None
+    signature = face_signature(frame, track["box"])
+    if signature is None or float(np.abs(signature - track["signature"]).mean()) > FACE_TRACK_MAX_DIFF:
+        return None
+    return track["identity"]
+
+def update_face_track(frame, face, identity, session_id):
+    """Start tracking the face that was just identified in a session's camera"""
+    now = time.time()
+    # Drop expired tracks so sessions that went away don't pile up
+    for sid, track in list(_face_tracks.items()):
+        if now - track["at"] > FACE_TRACK_TTL:
+            _face_tracks.pop(sid, None)
+
+    area = face.get('facial_area') or {}
+    box = (int(area.get('x', 0)), int(area.get('y', 0)), int(area.get('w', 0)), int(area.get('h', 0)))
+    frame_h, frame_w = frame.shape[:2]
+    # No real detection (DeepFace falls back to the whole frame) - nothing to track
+    if box[2] <= 0 or box[3] <= 0 or box[2] * box[3] >= 0.95 * frame_w * frame_h:
+        _face_tracks.pop(session_id, None)
+        return
+    signature = face_signature(frame, box)
+    if signature is None:
+        _face_tracks.pop(session_id, None)
+        return
+    _face_tracks[session_id] = {
+        "box": box,
+        "frame_size": (frame_h, frame_w),
+        "signature": signature,
+        "identity": identity,
+        "at": now
+    }
+
+def clear_face_track(session_id=None):
+    """Forget a session's tracked face, or every session's (e.g. after the known faces change)"""
+    if session_id is None:
+        _face_tracks.clear()
+    else:
+        _face_tracks.pop(session_id, None)
+
+# ===== FACE RECOGNITION WARM-UP =====
+# Opt-in (FACE_WARMUP=true): load TensorFlow, the model weights and the face index
+# in a background thread at boot, so the first /api/identify doesn't pay for it.
+FACE_WARMUP = os.getenv('FACE_WARMUP', 'false').lower() == 'true'
+
+face_warmup_state = {
+    "status": "idle",  # idle | loading | ready | error
+    "stage": None,  # Current warm-up step while loading
+    "started_at": None,
+    "finished_at": None,
+    "error": None
+}
+_face_warmup_lock = threading.Lock()
+
+def run_face_warmup():
+    """Load DeepFace, the model and the face index, then run one dummy inference"""
+    if FACE_WORKERS > 0:
+        # Each worker loads the model and runs its own dummy inference before going idle
+        stages = [("starting face workers", lambda: get_face_pool().wait_ready())]
+    else:
+        stages = [
+            ("importing deepface", get_deepface),
+            ("loading model weights", lambda: get_deepface().build_model(FACE_MODEL_NAME)),
+            ("dummy inference", lambda: embed_face_image(np.zeros((224, 224, 3), dtype=np.uint8)))
+        ]
+    stages.append(("loading face index", get_face_index))
+    try:
+        for stage, step in stages:
+            face_warmup_state["stage"] = stage
+            print(f"Face warm-up: {stage}...")
+            step()
+        face_warmup_state["status"] = "ready"
+        face_warmup_state["stage"] = None
+        print(f"Face warm-up: ready in {time.time() - face_warmup_state['started_at']:.1f}s")
+    except Exception as e:
+        face_warmup_state["status"] = "error"
+        face_warmup_state["error"] = str(e)
+        print(f"Face warm-up error during {face_warmup_state['stage']}: {e}")
+    finally:
+        face_warmup_state["finished_at"] = time.time()
+
+def start_face_warmup():
+    """Start the warm-up thread (no-op if it already started)"""
+    with _face_warmup_lock:
+        if face_warmup_state["status"] != "idle":
+            return
+        face_warmup_state["status"] = "loading"
+        face_warmup_state["started_at"] = time.time()
+    threading.Thread(target=run_face_warmup, name="face-warmup", daemon=True).start()
+
+def face_warming_up():
+    """True while warm-up is enabled and the model isn't loaded yet"""
+    if not FACE_WARMUP:
+        return False
+    if face_warmup_state["status"] == "idle":
+        start_face_warmup()  # e.g. when not started from __main__
+    return face_warmup_state["status"] == "loading"
+
+@app.route('/api/face/ready', methods=['GET'])
+def face_ready():
+    """Readiness of face recognition - 503 until warm-up has finished"""
+    ready = not FACE_WARMUP or face_warmup_state["status"] == "ready"
+    status = {
+        "ready": ready,
+        "model": FACE_MODEL_NAME,
+        "warmup_enabled": FACE_WARMUP,
+        **face_warmup_state
+    }
+    if face_warmup_state["started_at"]:
+        end = face_warmup_state["finished_at"] or time.time()
+        status["elapsed_seconds"] = round(end - face_warmup_state["started_at"], 1)
+    if _face_pool:
+        status["pool"] = _face_pool.status()
+    return jsonify(status), (200 if ready else 503)
 
 @app.route('/')
 def serve_index():
@@ -175,8 +1335,425 @@ def serve_face_photo(name, filename):
 # Configure Gemini
 genai.configure(api_key=os.getenv('GEMINI_API_KEY'))
 
-# Store the latest frame from the client
-latest_frame = None
+# ===== FRAME STORE =====
+# Frames are kept per session (X-Session-Id header or ?session_id=), so two users'
+# cameras never overwrite each other. Each session holds its last FRAME_HISTORY
+# frames in a ring buffer; the whole store is capped at FRAME_STORE_MAX_MB and idle
+# sessions are evicted least-recently-used first. Frames are stored decoded:
+# {"data": image bytes, "mime_type": "image/jpeg", "received_at": last seen,
+#  "changed_at": first seen, "hash": 64-bit dHash, "thumb": gray thumbnail, "change_score": 0-1}
+FRAME_HISTORY = int(os.getenv('FRAME_HISTORY', '8'))  # Frames kept per session
+FRAME_STORE_MAX_MB = int(os.getenv('FRAME_STORE_MAX_MB', '256'))
+FRAME_SESSION_IDLE_SECONDS = int(os.getenv('FRAME_SESSION_IDLE_SECONDS', '600'))
+# Frames whose thumbnail differs from the session's last stored frame by less than
+# this (mean absolute gray difference, 0-1) only refresh that frame's timestamp
+FRAME_DUPLICATE_THRESHOLD = float(os.getenv('FRAME_DUPLICATE_THRESHOLD', '0.02'))
+FRAME_THUMB_SIZE = 32
+
+def frame_fingerprint(image_bytes):
+    """Cheap change-detection fingerprint: 64-bit dHash and a small grayscale thumbnail"""
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img.draft('L', (FRAME_THUMB_SIZE * 4, FRAME_THUMB_SIZE * 4))  # JPEG: decode at reduced scale
+        gray = img.convert('L')
+    thumb = np.asarray(gray.resize((FRAME_THUMB_SIZE, FRAME_THUMB_SIZE), Image.BILINEAR), dtype=np.float32) / 255
+    small = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).reshape(-1)
+    dhash = int(np.packbits(bits).view('>u8')[0])
+    return dhash, thumb
+
+def frame_change_score(thumb, previous):
+    """Mean absolute difference between two frame thumbnails (0 = identical, 1 = inverted)"""
+    if previous is None or previous.shape != thumb.shape:
+        return 1.0
+    return float(np.abs(thumb - previous).mean())
+
+def get_session_id():
+    """Session the request belongs to (None if the client didn't say - e.g. Hume tool calls)"""
+    session_id = request.headers.get('X-Session-Id') or request.args.get('session_id')
+    if session_id and session_id not in ('undefined', 'null'):
+        return session_id[:64]
+    return None
+
+# Multi-process deployments (e.g. gunicorn -w 4): set FRAME_SHARED_BUFFER to a file path
+# (ideally on tmpfs, e.g. /dev/shm/djfoambot-frames) and every worker publishes each
+# session's latest frame into an mmap'd slot there, so a frame POSTed to one worker is
+# visible to the worker that answers /api/vision or /api/identify.
+FRAME_SHARED_BUFFER = os.getenv('FRAME_SHARED_BUFFER', '')
+FRAME_SHARED_SLOTS = int(os.getenv('FRAME_SHARED_SLOTS', '32'))  # Sessions shared at once
+FRAME_SHARED_SLOT_KB = int(os.getenv('FRAME_SHARED_SLOT_KB', '512'))  # Max frame size shared
+
+class SharedFrameBuffer:
+    """
+    Latest frame per session in an mmap'd file, readable from any worker process.
+
+    Each slot is guarded by a seqlock: writers (serialized across processes with
+    flock) make the sequence number odd, write, then make it even again; readers
+    copy the slot and retry if the sequence changed underneath them. Readers never
+    lock, and a frame is only copied out once per worker (keyed by its content id).
+    """
+    MAGIC = b'DJFRAME1'
+    HEADER = struct.Struct('<8sII')  # magic, slots, slot size
+    # seq, content id, session id, received_at, changed_at, change score, dhash, mime type, data length
+    SLOT = struct.Struct('<QQ64sddfQ16sI')
+    THUMB_BYTES = FRAME_THUMB_SIZE * FRAME_THUMB_SIZE * 4
+
+    def __init__(self, path, slots, slot_bytes):
+        import fcntl, mmap
+        self.flock = fcntl.flock
+        self.lock_ex, self.lock_un = fcntl.LOCK_EX, fcntl.LOCK_UN
+        self.path = path
+        self.slots = slots
+        self.data_bytes = slot_bytes
+        self.slot_size = self.SLOT.size + self.THUMB_BYTES + slot_bytes
+        size = self.HEADER.size + slots * self.slot_size
+
+        self.fd = self._open(path, size, self.HEADER.pack(self.MAGIC, slots, self.slot_size))
+        self.mm = mmap.mmap(self.fd, size)
+        self.slot_of = {}  # session key -> slot index (hint, verified on use)
+        self.cache = {}  # slot index -> (content id, session key, frame dict) last consistent copy
+        self.content_ids = itertools.count(int(time.time() * 1000) << 16)  # Unique across workers in practice
+        self.too_large = 0
+
+    def _open(self, path, size, header):
+        """
+        Open (creating if needed) a buffer file with this layout. A file with another
+        layout is never truncated - workers still running map it and would crash - so a
+        fresh file is renamed over it instead.
+        """
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            ready = False
+            self.flock(fd, self.lock_ex)
+            try:
+                try:
+                    replaced = os.stat(path).st_ino != os.fstat(fd).st_ino
+                except FileNotFoundError:
+                    replaced = True
+                if replaced:
+                    continue  # Another worker swapped the file while we waited for the lock
+                current = os.fstat(fd).st_size
+                if current == 0:
+                    # New file - nobody maps it until it's initialized
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, header, 0)
+                elif current != size or os.pread(fd, self.HEADER.size, 0) != header:
+                    print(f"Shared frame buffer {path} has another layout, replacing it")
+                    tmp_path = f"{path}.{os.getpid()}.tmp"
+                    tmp_fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+                    try:
+                        os.ftruncate(tmp_fd, size)
+                        os.pwrite(tmp_fd, header, 0)
+                    finally:
+                        os.close(tmp_fd)
+                    os.replace(tmp_path, path)
+                    continue
+                ready = True
+                return fd
+            finally:
+                self.flock(fd, self.lock_un)
+                if not ready:
+                    os.close(fd)
+
+    def _offset(self, index):
+        return self.HEADER.size + index * self.slot_size
+
+    def _key(self, session_id):
+        return session_id.encode('utf-8')[:64].ljust(64, b'\0')
+
+    def _read_header(self, index):
+        return self.SLOT.unpack_from(self.mm, self._offset(index))
+
+    def _find(self, key):
+        """Slot holding a session, or None. Lock-free"""
+        index = self.slot_of.get(key)
+        if index is not None and self._read_header(index)[2] == key:
+            return index
+        for index in range(self.slots):
+            if self._read_header(index)[2] == key:
+                self.slot_of[key] = index
+                return index
+        return None
+
+    def _write(self, index, fields, thumb=None, data=None):
+        """Seqlocked slot update (caller holds the flock)"""
+        offset = self._offset(index)
+        seq = self.SLOT.unpack_from(self.mm, offset)[0]
+        struct.pack_into('<Q', self.mm, offset, seq + 1)  # Odd: write in progress
+        struct.pack_into('<QQ64sddfQ16sI', self.mm, offset, seq + 1, *fields)
+        if thumb is not None:
+            start = offset + self.SLOT.size
+            self.mm[start:start + self.THUMB_BYTES] = np.ascontiguousarray(thumb, dtype=np.float32).tobytes()
+        if data is not None:
+            start = offset + self.SLOT.size + self.THUMB_BYTES
+            self.mm[start:start + len(data)] = data
+        struct.pack_into('<Q', self.mm, offset, seq + 2)  # Even: consistent again
+
+    def publish(self, session_id, frame):
+        """Make a frame the session's shared latest frame"""
+        if len(frame["data"]) > self.data_bytes:
+            self.too_large += 1
+            return
+        key = self._key(session_id)
+        content_id = next(self.content_ids)
+        self.flock(self.fd, self.lock_ex)
+        try:
+            index = self._find(key)
+            if index is None:
+                # Free slot, else the one whose session was updated longest ago
+                headers = [self._read_header(i) for i in range(self.slots)]
+                index = min(range(self.slots), key=lambda i: (headers[i][2] != b'\0' * 64, headers[i][3]))
+                self.slot_of[key] = index
+            fields = (content_id, key, frame["received_at"], frame["changed_at"], frame["change_score"],
+                      frame["hash"], frame["mime_type"].encode()[:16], len(frame["data"]))
+            self._write(index, fields, frame["thumb"], frame["data"])
+        finally:
+            self.flock(self.fd, self.lock_un)
+        self.cache[index] = (content_id, key, frame)  # This worker already has the frame
+
+    def touch(self, session_id, received_at):
+        """Refresh the session's shared frame timestamp (duplicate frame)"""
+        key = self._key(session_id)
+        self.flock(self.fd, self.lock_ex)
+        try:
+            index = self._find(key)
+            if index is not None:
+                fields = list(self._read_header(index)[1:])
+                fields[2] = received_at
+                self._write(index, fields)
+        finally:
+            self.flock(self.fd, self.lock_un)
+
+    def _read(self, index, want_key):
+        """
+        Consistent copy of a session's slot, reusing this worker's copy if the content hasn't
+        changed. If writers keep it busy, falls back to the last consistent copy this worker saw.
+        """
+        offset = self._offset(index)
+        for attempt in range(20):
+            if attempt:
+                time.sleep(0.0005 * attempt)  # Let the writer finish copying (up to a slot of data)
+            header = self.SLOT.unpack_from(self.mm, offset)
+            seq, content_id, key, received_at, changed_at, change_score, dhash, mime_type, length = header
+            if seq % 2:
+                continue
+            if key != want_key:
+                return None  # Slot was taken over by another session
+            cached = self.cache.get(index)
+            if cached and cached[0] == content_id:
+                frame = cached[2]
+            else:
+                start = offset + self.SLOT.size
+                thumb = np.frombuffer(self.mm[start:start + self.THUMB_BYTES], dtype=np.float32)
+                data = self.mm[start + self.THUMB_BYTES:start + self.THUMB_BYTES + length]
+                frame = {
+                    "data": data,
+                    "mime_type": mime_type.rstrip(b'\0').decode(),
+                    "changed_at": changed_at,
+                    "hash": dhash,
+                    "thumb": thumb.reshape(FRAME_THUMB_SIZE, FRAME_THUMB_SIZE),
+                    "change_score": change_score
+                }
+            if self.SLOT.unpack_from(self.mm, offset)[0] != seq:
+                continue  # Written while we were reading - retry
+            frame["received_at"] = received_at
+            self.cache[index] = (content_id, key, frame)
+            return frame
+        cached = self.cache.get(index)
+        return cached[2] if cached and cached[1] == want_key else None
+
+    def latest(self, session_id):
+        """Session's shared latest frame. Lock-free"""
+        key = self._key(session_id)
+        index = self._find(key)
+        return self._read(index, key) if index is not None else None
+
+    def active_sessions(self, since):
+        """Sessions whose shared frame was received at or after since. Lock-free"""
+        headers = [self._read_header(i) for i in range(self.slots)]
+        return {h[2].rstrip(b'\0').decode('utf-8', 'ignore') for h in headers if h[2] != b'\0' * 64 and h[3] >= since}
+
+    def stats(self):
+        used = sum(1 for i in range(self.slots) if self._read_header(i)[2] != b'\0' * 64)
+        return {
+            "path": self.path,
+            "slots": self.slots,
+            "used_slots": used,
+            "slot_kb": self.data_bytes // 1024,
+            "too_large": self.too_large
+        }
+
+class FrameStore:
+    """Per-session frame ring buffers with a global memory ceiling and LRU session eviction"""
+
+    def __init__(self, history, max_bytes, idle_seconds, duplicate_threshold, shared=None):
+        self.shared = shared  # SharedFrameBuffer when several worker processes serve requests
+        self.history = history
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self.duplicate_threshold = duplicate_threshold
+        self.sessions = OrderedDict()  # session_id -> deque of frames, least recently updated first
+        self.total_bytes = 0
+        self.evicted_sessions = 0
+        self.duplicate_frames = 0
+        self.lock = threading.Lock()  # Taken by writers only - reads never block
+
+    def put(self, session_id, frame):
+        """
+        Append a frame to a session's ring buffer, then enforce the limits.
+        A near-duplicate of the session's latest frame is not stored; the latest
+        frame's timestamp is refreshed instead. Returns (stored frame, duplicate).
+        """
+        with self.lock:
+            frames = self.sessions.get(session_id)
+            previous = self.latest(session_id)  # May have arrived at another worker
+            frame["change_score"] = frame_change_score(frame["thumb"], previous and previous["thumb"])
+            if previous is not None and frame["change_score"] < self.duplicate_threshold:
+                previous["received_at"] = frame["received_at"]
+                if self.shared:
+                    self.shared.touch(session_id, frame["received_at"])
+                if frames:
+                    self.sessions.move_to_end(session_id)
+                self.duplicate_frames += 1
+                return previous, True
+
+            if frames is None:
+                frames = deque(maxlen=self.history)
+            elif len(frames) == self.history:
+                self.total_bytes -= self._release(frames[0])
+            frame["stored_bytes"] = len(frame["data"])
+            frames.append(frame)
+            self.total_bytes += frame["stored_bytes"]
+            self.sessions[session_id] = frames
+            self.sessions.move_to_end(session_id)
+            self._evict(session_id)
+            if self.shared:
+                self.shared.publish(session_id, frame)
+            return frame, False
+
+    @staticmethod
+    def _release(frame):
+        """Bytes a frame leaving the store was counted for (caller holds the lock)"""
+        return frame.pop("stored_bytes", 0)
+
+    def attach(self, frame, key, value, size):
+        """
+        Cache derived data (e.g. the downscaled vision upload) on a frame. While the frame
+        is stored, its size counts against the memory ceiling like the frame itself.
+        """
+        with self.lock:
+            frame[key] = value
+            if "stored_bytes" in frame:
+                frame["stored_bytes"] += size
+                self.total_bytes += size
+                if self.total_bytes > self.max_bytes:
+                    self._evict(None)
+
+    def _evict(self, current_session):
+        """Drop idle sessions, then oldest frames of the least recently updated sessions (caller holds the lock)"""
+        now = time.time()
+        for session_id in list(self.sessions):
+            frames = self.sessions[session_id]
+            if session_id != current_session and now - frames[-1]["received_at"] > self.idle_seconds:
+                self._drop_session(session_id)
+
+        for session_id in list(self.sessions):
+            frames = self.sessions[session_id]
+            # Always keep the newest frame of the session that was just updated
+            keep = 1 if session_id == current_session else 0
+            while self.total_bytes > self.max_bytes and len(frames) > keep:
+                self.total_bytes -= self._release(frames.popleft())
+            if not frames:
+                self._drop_session(session_id)
+            if self.total_bytes <= self.max_bytes:
+                break
+
+    def _drop_session(self, session_id):
+        frames = self.sessions.pop(session_id)
+        self.total_bytes -= sum(self._release(f) for f in frames)
+        self.evicted_sessions += 1
+
+    def only_session(self):
+        """
+        The one session that sent a frame in the last idle_seconds - None if there are none
+        or several (a caller without a session must never see another user's camera). Lock-free
+        """
+        since = time.time() - self.idle_seconds
+        active = {session_id for session_id, frames in list(self.sessions.items())
+                  if frames and frames[-1]["received_at"] >= since}
+        if self.shared:
+            active |= self.shared.active_sessions(since)
+        return next(iter(active)) if len(active) == 1 else None
+
+    def latest(self, session_id=None):
+        """Newest frame of a session (None: of the only active session, see only_session). Lock-free"""
+        session_id = session_id or self.only_session()
+        if session_id is None:
+            return None
+        frames = self.sessions.get(session_id)
+        try:
+            local = frames[-1]
+        except (IndexError, TypeError):
+            local = None
+        if self.shared is None:
+            return local
+        # Another worker may have received a newer frame
+        shared = self.shared.latest(session_id)
+        if shared is None or (local is not None and local["changed_at"] >= shared["changed_at"]):
+            return local
+        return shared
+
+    def frames(self, session_id=None):
+        """Snapshot of a session's frame history, oldest first (None: the only active session). Lock-free"""
+        frames = self.sessions.get(session_id or self.only_session())
+        return list(frames) if frames else []
+
+    def stats(self):
+        return {
+            "sessions": len(self.sessions),
+            "frames": sum(len(f) for f in list(self.sessions.values())),
+            "memory_mb": round(self.total_bytes / (1024**2), 2),
+            "max_memory_mb": round(self.max_bytes / (1024**2), 2),
+            "history_per_session": self.history,
+            "evicted_sessions": self.evicted_sessions,
+            "duplicate_frames": self.duplicate_frames,
+            "shared": self.shared.stats() if self.shared else None
+        }
+
+frame_store = FrameStore(FRAME_HISTORY, FRAME_STORE_MAX_MB * 1024 * 1024, FRAME_SESSION_IDLE_SECONDS,
+                         FRAME_DUPLICATE_THRESHOLD,
+                         SharedFrameBuffer(FRAME_SHARED_BUFFER, FRAME_SHARED_SLOTS, FRAME_SHARED_SLOT_KB * 1024)
+                         if FRAME_SHARED_BUFFER else None)
+
+FRAME_MIME_TYPES = {'image/jpeg', 'image/png', 'image/webp'}
+FRAME_MAX_BYTES = 5 * 1024 * 1024
+
+def decode_data_url(image_data):
+    """Decode a base64 image (optionally a data: URL) into (bytes, mime_type)"""
+    mime_type = 'image/jpeg'
+    if ',' in image_data:
+        header, image_data = image_data.split(',', 1)
+        if header.startswith('data:'):
+            mime_type = header[5:].split(';')[0] or mime_type
+    return base64.b64decode(image_data), mime_type
+
+def read_frame_upload():
+    """
+    Read an uploaded frame from the request in any supported form:
+    raw image body (Content-Type: image/jpeg), multipart ("image" or "frame" file),
+    or legacy JSON { "image": "data:image/jpeg;base64,..." }.
+    Returns (bytes, mime_type), or (None, error message).
+    """
+    if request.mimetype in FRAME_MIME_TYPES:
+        return request.get_data(), request.mimetype
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('image') or request.files.get('frame')
+        if not upload:
+            return None, "No image file provided"
+        return upload.read(), upload.mimetype if upload.mimetype in FRAME_MIME_TYPES else 'image/jpeg'
+    data = request.get_json(silent=True)
+    if not data or 'image' not in data:
+        return None, "No image data provided"
+    return decode_data_url(data['image'])
 
 @app.route('/api/health', methods=['GET'])
 def health():
@@ -225,197 +1802,1044 @@ def get_hume_token():
 
 @app.route('/api/frame', methods=['POST'])
 def receive_frame():
-    """Receive a frame from the client's camera"""
-    global latest_frame
-
-    data = request.get_json()
-    if not data or 'image' not in data:
-        return jsonify({"error": "No image data provided"}), 400
-
-    latest_frame = data['image']  # base64 encoded image
-    return jsonify({"status": "frame received"})
-
-@app.route('/api/vision', methods=['POST'])
-def vision():
     """
-    Hume tool endpoint - analyze what the camera sees
-    Called when user says trigger words like "look", "see", "what is this"
+    Receive a frame from the client's camera.
+    Preferred: raw JPEG body with Content-Type: image/jpeg (or multipart).
+    JSON with a base64 data URL still works for old clients.
     """
-    global latest_frame
-
-    if not latest_frame:
-        return jsonify({
-            "response": "I can't see anything right now. The camera doesn't seem to be enabled. Tell the human to click the camera button if they want me to see."
-        })
+    # Bounded read, so chunked uploads without a Content-Length are capped too. Werkzeug
+    # stops such a body at the limit, so one byte over the cap marks it as too large.
+    # The body is cached, and read_frame_upload parses it from there.
+    request.max_content_length = FRAME_MAX_BYTES + 1
+    try:
+        if len(request.get_data()) > FRAME_MAX_BYTES:
+            return jsonify({"error": "Frame too large"}), 413
+    except RequestEntityTooLarge:
+        return jsonify({"error": "Frame too large"}), 413
 
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(latest_frame.split(',')[1] if ',' in latest_frame else latest_frame)
+        image_bytes, mime_type = read_frame_upload()
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid image data: {e}"}), 400
+    if image_bytes is None:
+        return jsonify({"error": mime_type}), 400
+    if not image_bytes:
+        return jsonify({"error": "Empty image data"}), 400
 
-        # Use Gemini Vision to analyze the image
-        model = genai.GenerativeModel('gemini-2.0-flash')
+    try:
+        return jsonify(ingest_frame(get_session_id() or 'default', image_bytes, mime_type))
+    except (OSError, ValueError) as e:
+        return jsonify({"error": f"Invalid image data: {e}"}), 400
+
+def ingest_frame(session_id, image_bytes, mime_type):
+    """Store an uploaded frame for a session (HTTP or WebSocket). Raises OSError/ValueError for undecodable images"""
+    dhash, thumb = frame_fingerprint(image_bytes)
+    now = time.time()
+    incoming = {
+        "data": image_bytes,  # Decoded once here, not on every vision call
+        "mime_type": mime_type,
+        "received_at": now,
+        "changed_at": now,
+        "hash": dhash,
+        "thumb": thumb
+    }
+    frame, duplicate = frame_store.put(session_id, incoming)
+    if not duplicate:
+        schedule_vision_prefetch(session_id, frame)
+    return {
+        "status": "frame received",
+        "duplicate": duplicate,  # True: unchanged scene, only the stored frame's timestamp was refreshed
+        "change_score": round(incoming["change_score"], 4),
+        "frame_hash": f"{frame['hash']:016x}",
+        "capture": capture_hints(session_id)
+    }
 
-        # Create the image part for Gemini
-        image_part = {
-            "mime_type": "image/jpeg",
-            "data": image_data
-        }
+@app.route('/api/frames/stats', methods=['GET'])
+def frame_stats():
+    """Frame store usage: sessions, buffered frames and memory, plus identified sessions"""
+    return jsonify({**frame_store.stats(), "identity": identity_store.stats()})
 
-        prompt = """You are Pi-Guy, a sarcastic AI with attitude. Describe what you see in this image in 1-2 sentences.
+# ===== VISION =====
+VISION_PROMPT = """You are Pi-Guy, a sarcastic AI with attitude. Describe what you see in this image in 1-2 sentences.
 Be snarky, rude, and unimpressed. You're annoyed at having to look at things for humans.
 Keep it brief but make sure to actually describe what's in the image.
 Don't mention that you're an AI or that this is an image - just describe what you "see" as if you're looking through your camera."""
 
-        response = model.generate_content([prompt, image_part])
+VISION_NO_FRAME_RESPONSE = "I can't see anything right now. The camera doesn't seem to be enabled. Tell the human to click the camera button if they want me to see."
+VISION_ERROR_RESPONSE = "Ugh, my vision circuits are acting up. I can't process what I'm seeing right now. Typical."
+
+VISION_BACKEND = os.getenv('VISION_BACKEND', 'gemini')  # gemini | offline
+VISION_MODEL = os.getenv('VISION_MODEL', 'gemini-2.0-flash')
+VISION_TIMEOUT = float(os.getenv('VISION_TIMEOUT', '20'))  # Seconds per model call, from when it starts
+VISION_MAX_CONCURRENCY = int(os.getenv('VISION_MAX_CONCURRENCY', '4'))
+VISION_QUEUE_TIMEOUT = float(os.getenv('VISION_QUEUE_TIMEOUT', '10'))  # Max seconds a call waits for a free slot
+
+class GeminiVisionBackend:
+    """Gemini over the network; the model client is built once and reused"""
+    name = 'gemini'
+
+    def __init__(self, model_name=VISION_MODEL):
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def describe(self, prompt, image_parts, timeout):
+        response = self.model.generate_content([prompt, *image_parts], request_options={"timeout": timeout})
+        return response.text.strip()
+
+    def stream(self, prompt, image_parts, timeout):
+        """Yield text chunks as Gemini generates them"""
+        response = self.model.generate_content([prompt, *image_parts], stream=True, request_options={"timeout": timeout})
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+class OfflineVisionBackend:
+    """
+    No network: a deterministic description built from the image itself.
+    For tests and benchmarks (VISION_OFFLINE_LATENCY simulates a model round trip).
+    """
+    name = 'offline'
+
+    def __init__(self, latency=None):
+        self.model_name = 'offline'
+        self.latency = float(os.getenv('VISION_OFFLINE_LATENCY', '0')) if latency is None else latency
+
+    def describe(self, prompt, image_parts, timeout):
+        time.sleep(min(self.latency, timeout))
+        scenes = []
+        for part in image_parts:
+            with Image.open(io.BytesIO(part["data"])) as img:
+                brightness = float(np.asarray(img.convert('L').resize((32, 32))).mean())
+                scenes.append(f"a {img.width}x{img.height} {'bright' if brightness > 110 else 'dim'} scene")
+        return "Ugh, " + ", then ".join(scenes) + ". Thrilling."
+
+    def stream(self, prompt, image_parts, timeout):
+        """Yield the offline description a few words at a time, spreading the simulated latency"""
+        words = self.describe(prompt, image_parts, 0).split(' ')
+        for i in range(0, len(words), 3):
+            time.sleep(min(self.latency, timeout) / max(1, len(words) // 3))
+            yield ' '.join(words[i:i + 3]) + ' '
+
+# Local CPU models can register here as another backend with the same describe() signature
+VISION_BACKENDS = {
+    'gemini': GeminiVisionBackend,
+    'offline': OfflineVisionBackend
+}
+
+class VisionEngine:
+    """One shared vision pipeline: backend, prompt template, per-call timeout and latency metrics"""
+
+    def __init__(self, backend, prompt=VISION_PROMPT, timeout=VISION_TIMEOUT, max_concurrency=VISION_MAX_CONCURRENCY,
+                 queue_timeout=VISION_QUEUE_TIMEOUT):
+        self.backend = backend
+        self.prompt = prompt
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="vision")
+        self.latencies = deque(maxlen=200)  # Seconds, most recent successful calls
+        self.first_chunk_latencies = deque(maxlen=200)  # Seconds to the first streamed chunk
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.saturated = 0  # Calls rejected because no slot freed up within queue_timeout
+        self.running = 0  # Backend calls occupying an executor slot
+        self.abandoned = 0  # ... of which the caller already gave up on (timed out)
+        self.lock = threading.Lock()
+
+    def _start(self, fn, *args):
+        """
+        Run fn on the executor, waiting at most queue_timeout for a free slot.
+        Returns (future, started_at) - per-call timeouts are measured from started_at.
+        """
+        started = threading.Event()
+        started_at = []
+
+        def call():
+            with self.lock:
+                self.running += 1
+            started_at.append(time.time())
+            started.set()
+            try:
+                return fn(*args)
+            finally:
+                with self.lock:
+                    self.running -= 1
+
+        future = self.executor.submit(call)
+        if not started.wait(self.queue_timeout):
+            if future.cancel():
+                self.saturated += 1
+                raise TimeoutError(f"Vision engine saturated: no free slot within {self.queue_timeout}s")
+            started.wait()  # Got a slot just as we gave up
+        return future, started_at[0]
+
+    def _abandon(self, future):
+        """
+        Stop waiting for a call that overran its timeout. A running thread can't be
+        cancelled - it holds its slot until the backend's own request timeout fires,
+        and is reported as abandoned until then.
+        """
+        self.timeouts += 1
+        with self.lock:
+            self.abandoned += 1
+
+        def finished(_):
+            with self.lock:
+                self.abandoned -= 1
+        future.add_done_callback(finished)
+
+    def describe(self, image_parts, prompt=None, timeout=None):
+        """
+        Describe one or more image parts. Raises TimeoutError if no slot frees up within
+        queue_timeout, or if the backend runs longer than the timeout once started.
+        """
+        prompt = prompt or self.prompt
+        timeout = timeout or self.timeout
+        self.calls += 1
+        future, started_at = self._start(self.backend.describe, prompt, image_parts, timeout)
+        try:
+            description = future.result(timeout=max(0.0, started_at + timeout - time.time()))
+        except FutureTimeoutError:
+            self._abandon(future)
+            raise TimeoutError(f"Vision backend took longer than {timeout}s")
+        except Exception:
+            self.errors += 1
+            raise
+        self.latencies.append(time.time() - started_at)
+        return description
+
+    def stream(self, image_parts, prompt=None, timeout=None):
+        """
+        Yield text chunks as the backend produces them. The backend runs on the executor
+        like describe(), feeding a queue, so a backend that stalls (even before its first
+        chunk) raises TimeoutError once the timeout has passed since it started.
+        """
+        prompt = prompt or self.prompt
+        timeout = timeout or self.timeout
+        self.calls += 1
+        chunks = queue.Queue()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for chunk in self.backend.stream(prompt, image_parts, timeout):
+                    if stop.is_set():
+                        return  # Consumer timed out or went away
+                    chunks.put(("chunk", chunk))
+                chunks.put(("done", None))
+            except Exception as e:
+                chunks.put(("error", e))
+
+        future, started_at = self._start(produce)
+        first = True
+        try:
+            while True:
+                try:
+                    kind, value = chunks.get(timeout=max(0.0, started_at + timeout - time.time()))
+                except queue.Empty:
+                    self._abandon(future)
+                    raise TimeoutError(f"Vision stream took longer than {timeout}s")
+                if kind == "done":
+                    break
+                if kind == "error":
+                    self.errors += 1
+                    raise value
+                if first:
+                    self.first_chunk_latencies.append(time.time() - started_at)
+                    first = False
+                yield value
+        finally:
+            stop.set()
+        self.latencies.append(time.time() - started_at)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        first_chunk = sorted(self.first_chunk_latencies)
+        return {
+            "backend": self.backend.name,
+            "model": self.backend.model_name,
+            "timeout_seconds": self.timeout,
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "saturated": self.saturated,
+            "running": self.running,
+            "abandoned": self.abandoned,
+            "max_concurrency": self.max_concurrency,
+            "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000) if latencies else None,
+            "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000) if latencies else None,
+            "stream_first_chunk_p50_ms": round(first_chunk[len(first_chunk) // 2] * 1000) if first_chunk else None
+        }
+
+if VISION_BACKEND not in VISION_BACKENDS:
+    raise ValueError(f"Unknown VISION_BACKEND '{VISION_BACKEND}' (choose from: {', '.join(VISION_BACKENDS)})")
+vision_engine = VisionEngine(VISION_BACKENDS[VISION_BACKEND]())
+
+# Description cache: a visually equivalent frame (dHash within VISION_CACHE_MAX_DISTANCE
+# bits) asked the same prompt within VISION_CACHE_TTL seconds reuses the last description
+VISION_CACHE_TTL = float(os.getenv('VISION_CACHE_TTL', '15'))
+VISION_CACHE_SIZE = int(os.getenv('VISION_CACHE_SIZE', '64'))
+VISION_CACHE_MAX_DISTANCE = int(os.getenv('VISION_CACHE_MAX_DISTANCE', '3'))
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+class VisionCache:
+    """LRU + TTL cache of vision descriptions keyed by (frame dHash, prompt)"""
+
+    def __init__(self, size, ttl, max_distance):
+        self.size = size
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.entries = OrderedDict()  # (hash, prompt) -> {"description", "at", "latency"}, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0  # Model latency avoided by hits
+        self.lock = threading.Lock()
+
+    def get(self, frame_hash, prompt, count=True):
+        """Cache entry for a similar frame and the same prompt, else None (count=False: not a user lookup)"""
+        now = time.time()
+        with self.lock:
+            best_key, best_distance = None, self.max_distance + 1
+            for key, entry in list(self.entries.items()):
+                if now - entry["at"] > self.ttl:
+                    del self.entries[key]
+                    continue
+                if key[1] != prompt:
+                    continue
+                distance = hamming_distance(key[0], frame_hash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                if count:
+                    self.misses += 1
+                return None
+            self.entries.move_to_end(best_key)
+            entry = self.entries[best_key]
+            if count:
+                self.hits += 1
+                self.saved_seconds += entry["latency"]
+            return entry
+
+    def put(self, frame_hash, prompt, description, latency, prefetched=False):
+        with self.lock:
+            self.entries[(frame_hash, prompt)] = {
+                "description": description,
+                "at": time.time(),
+                "latency": latency,
+                "prefetched": prefetched
+            }
+            self.entries.move_to_end((frame_hash, prompt))
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+            return self.entries.get((frame_hash, prompt))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.size,
+            "ttl_seconds": self.ttl,
+            "max_distance": self.max_distance,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "saved_seconds": round(self.saved_seconds, 2)
+        }
+
+vision_cache = VisionCache(VISION_CACHE_SIZE, VISION_CACHE_TTL, VISION_CACHE_MAX_DISTANCE)
+
+# Frames are downscaled and recompressed once before they go to the cloud model -
+# a 1-2 sentence description doesn't need full webcam resolution
+VISION_MAX_EDGE = int(os.getenv('VISION_MAX_EDGE', '768'))  # 0 = send frames as captured
+VISION_JPEG_QUALITY = int(os.getenv('VISION_JPEG_QUALITY', '75'))
+vision_image_stats = {"frames": 0, "original_bytes": 0, "sent_bytes": 0, "prepare_seconds": 0.0}
+
+def vision_image_part(frame):
+    """Gemini image part for a stored frame, downscaled on first use and cached on the frame"""
+    part = frame.get("vision_part")
+    if part is not None:
+        return part
+
+    started = time.time()
+    data, mime_type = frame["data"], frame["mime_type"]
+    if VISION_MAX_EDGE > 0:
+        with Image.open(io.BytesIO(data)) as img:
+            if max(img.size) > VISION_MAX_EDGE or mime_type != 'image/jpeg':
+                img.draft('RGB', (VISION_MAX_EDGE, VISION_MAX_EDGE))  # JPEG: decode at reduced scale
+                img = img.convert('RGB')
+                img.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.LANCZOS)
+                buf = io.BytesIO()
+                img.save(buf, 'JPEG', quality=VISION_JPEG_QUALITY)
+                if buf.tell() < len(data):
+                    data, mime_type = buf.getvalue(), 'image/jpeg'
+
+    part = {"mime_type": mime_type, "data": data}
+    # Also reused by later duplicates of this frame; only a recompressed copy costs extra memory
+    frame_store.attach(frame, "vision_part", part, 0 if data is frame["data"] else len(data))
+    vision_image_stats["frames"] += 1
+    vision_image_stats["original_bytes"] += len(frame["data"])
+    vision_image_stats["sent_bytes"] += len(data)
+    vision_image_stats["prepare_seconds"] += time.time() - started
+    return part
+
+def vision_image_report():
+    frames = vision_image_stats["frames"]
+    return {
+        "max_edge": VISION_MAX_EDGE,
+        "jpeg_quality": VISION_JPEG_QUALITY,
+        "frames": frames,
+        "bytes_saved": vision_image_stats["original_bytes"] - vision_image_stats["sent_bytes"],
+        "avg_original_kb": round(vision_image_stats["original_bytes"] / frames / 1024, 1) if frames else None,
+        "avg_sent_kb": round(vision_image_stats["sent_bytes"] / frames / 1024, 1) if frames else None,
+        "avg_prepare_ms": round(vision_image_stats["prepare_seconds"] / frames * 1000, 1) if frames else None
+    }
+
+# Single-flight: concurrent requests for the same frame and prompt (agent tool call,
+# frontend, prefetch) share one model call - followers wait for the leader's result
+VISION_COALESCE_WAIT = float(os.getenv('VISION_COALESCE_WAIT', '60'))  # Max seconds a follower waits
+
+_vision_inflight = {}  # (frame hash, prompt) -> {"done": Event, "description", "entry", "error"}
+_vision_inflight_lock = threading.Lock()
+vision_flight_stats = {"model_calls": 0, "coalesced": 0}
+
+def join_vision_flight(key):
+    """Join the in-flight request for (frame hash, prompt), or start one. Returns (flight, leader)"""
+    with _vision_inflight_lock:
+        flight = _vision_inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _vision_inflight[key] = {"done": threading.Event(), "description": None, "entry": None, "error": None}
+        else:
+            vision_flight_stats["coalesced"] += 1
+    return flight, leader
+
+def wait_vision_flight(flight):
+    """Follower: wait for the leader's result. Returns (description, cache entry)"""
+    if not flight["done"].wait(VISION_COALESCE_WAIT):
+        raise TimeoutError("Timed out waiting for an in-flight vision request")
+    if flight["error"] is not None:
+        raise flight["error"]
+    return flight["description"], flight["entry"]
+
+def land_vision_flight(key, flight):
+    """Leader: publish the result (or error) set on the flight to its followers"""
+    with _vision_inflight_lock:
+        _vision_inflight.pop(key, None)
+    flight["done"].set()
+
+def describe_frame(frame, prompt=None, prefetch=False):
+    """
+    Describe a stored frame with Gemini, reusing a cached description for an equivalent frame
+    and joining an in-flight request for the same frame and prompt.
+    Returns (description, cache entry or None if this call ran the model).
+    """
+    prompt = prompt or vision_engine.prompt
+    entry = vision_cache.get(frame["hash"], prompt, count=not prefetch)  # Hit rate is for user-facing lookups
+    if entry is not None:
+        return entry["description"], entry
 
-        description = response.text.strip()
+    key = (frame["hash"], prompt)
+    flight, leader = join_vision_flight(key)
+    if not leader:
+        return wait_vision_flight(flight)
+
+    try:
+        flight["description"], flight["entry"] = generate_description(frame, prompt, prefetch)
+        return flight["description"], None
+    except Exception as e:
+        flight["error"] = e
+        raise
+    finally:
+        land_vision_flight(key, flight)
+
+def generate_description(frame, prompt, prefetch=False):
+    """Run the model on a frame and cache the result. Returns (description, cache entry)"""
+    vision_flight_stats["model_calls"] += 1
+
+    # Downscaled JPEG, prepared once per frame
+    image_part = vision_image_part(frame)
+
+    started = time.time()
+    description = vision_engine.describe([image_part], prompt)
+    latency = time.time() - started
+    if not description:
+        return description, None  # Never serve an empty description from the cache
+    entry = vision_cache.put(frame["hash"], prompt, description, latency, prefetched=prefetch)
+    return description, entry
+
+# ===== SPECULATIVE VISION PREFETCH =====
+# Opt-in: when a session's scene changes noticeably, describe the new frame in the
+# background so the next look_and_see tool call is answered from the cache.
+# Rate-limited globally, since every prefetch is a paid Gemini call that may never be used.
+VISION_PREFETCH = os.getenv('VISION_PREFETCH', 'false').lower() == 'true'
+VISION_PREFETCH_MIN_CHANGE = float(os.getenv('VISION_PREFETCH_MIN_CHANGE', '0.08'))
+VISION_PREFETCH_INTERVAL = float(os.getenv('VISION_PREFETCH_INTERVAL', '5'))  # Min seconds between prefetches
+
+_prefetch_pending = {}  # session_id -> newest frame waiting to be described
+_prefetch_lock = threading.Lock()
+_prefetch_wakeup = threading.Event()
+_prefetch_thread = None
+prefetch_stats = {"scheduled": 0, "requests": 0, "already_described": 0, "superseded": 0, "errors": 0}
+
+def schedule_vision_prefetch(session_id, frame):
+    """Queue a changed frame for background description (newer frames replace older ones)"""
+    global _prefetch_thread
+    if not VISION_PREFETCH or frame["change_score"] < VISION_PREFETCH_MIN_CHANGE:
+        return
+    with _prefetch_lock:
+        if session_id in _prefetch_pending:
+            prefetch_stats["superseded"] += 1
+        _prefetch_pending[session_id] = frame
+        prefetch_stats["scheduled"] += 1
+        if _prefetch_thread is None:
+            _prefetch_thread = threading.Thread(target=vision_prefetch_loop, daemon=True, name="vision-prefetch")
+            _prefetch_thread.start()
+    _prefetch_wakeup.set()
+
+def vision_prefetch_loop():
+    """Background worker: describe pending frames, at most one model call per VISION_PREFETCH_INTERVAL"""
+    last_request = 0.0
+    while True:
+        _prefetch_wakeup.wait()
+        time.sleep(max(0.0, last_request + VISION_PREFETCH_INTERVAL - time.time()))
+        with _prefetch_lock:
+            if not _prefetch_pending:
+                _prefetch_wakeup.clear()
+                continue
+            session_id = next(iter(_prefetch_pending))
+            frame = _prefetch_pending.pop(session_id)
+        # Skip frames the session has already moved past
+        if frame is not frame_store.latest(session_id):
+            prefetch_stats["superseded"] += 1
+            continue
+        last_request = time.time()
+        try:
+            _, entry = describe_frame(frame, prefetch=True)
+            if entry is None:
+                prefetch_stats["requests"] += 1
+            else:
+                prefetch_stats["already_described"] += 1  # Cached or in flight - not a cache hit
+        except Exception as e:
+            prefetch_stats["errors"] += 1
+            print(f"Vision prefetch error: {e}")
+
+# ===== VISION ENDPOINTS =====
+def vision_response():
+    """Describe the latest frame of the caller's session (shared by the POST and GET tool endpoints)"""
+    session_id = get_session_id() or frame_store.only_session()
+    latest_frame = frame_store.latest(session_id) if session_id else None
+
+    if not latest_frame:
+        return jsonify({
+            "response": VISION_NO_FRAME_RESPONSE
+        })
 
+    try:
+        description, entry = describe_frame(latest_frame)
+        ws_push({"type": "vision", "response": description}, session_id)
+        now = time.time()
         return jsonify({
-            "response": description
+            "response": description,
+            "cached": entry is not None,
+            "prefetched": bool(entry and entry["prefetched"]),
+            "frame_age": round(now - latest_frame["received_at"], 2),  # Seconds since the camera last showed this view
+            "description_age": round(now - entry["at"], 2) if entry else 0.0
         })
 
     except Exception as e:
         print(f"Vision error: {e}")
         return jsonify({
-            "response": "Ugh, my vision circuits are acting up. I can't process what I'm seeing right now. Typical."
+            "response": VISION_ERROR_RESPONSE
         })
 
+@app.route('/api/vision', methods=['POST'])
+def vision():
+    """
+    Hume tool endpoint - analyze what the camera sees
+    Called when user says trigger words like "look", "see", "what is this"
+    """
+    return vision_response()
+
 @app.route('/api/vision', methods=['GET'])
 def vision_get():
     """
     GET endpoint for Hume tool integration
     """
-    global latest_frame
+    return vision_response()
 
-    if not latest_frame:
-        return jsonify({
-            "response": "I can't see anything right now. The camera doesn't seem to be enabled. Tell the human to click the camera button if they want me to see."
-        })
+def sse_event(data, event=None):
+    """Format one Server-Sent Event"""
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
 
-    try:
-        # Decode base64 image
-        image_data = base64.b64decode(latest_frame.split(',')[1] if ',' in latest_frame else latest_frame)
+@app.route('/api/vision/stream', methods=['GET', 'POST'])
+def vision_stream():
+    """
+    Streaming variant of /api/vision (Server-Sent Events).
+    Sends {"text": chunk} events as the model generates, then a "done" event
+    with the full response - so the voice layer can start on the first sentence.
+    """
+    latest_frame = frame_store.latest(get_session_id())
+
+    def generate():
+        if not latest_frame:
+            yield sse_event({"response": VISION_NO_FRAME_RESPONSE}, "done")
+            return
+
+        prompt = vision_engine.prompt
+        entry = vision_cache.get(latest_frame["hash"], prompt)
+        if entry is not None:
+            yield sse_event({"text": entry["description"]})
+            yield sse_event({"response": entry["description"], "cached": True,
+                             "frame_age": round(time.time() - latest_frame["received_at"], 2)}, "done")
+            return
+
+        # Same single-flight as describe_frame: a stream for a frame that's already being
+        # described (streamed or not) waits for that result instead of calling the model again
+        key = (latest_frame["hash"], prompt)
+        flight, leader = join_vision_flight(key)
+        if not leader:
+            try:
+                description, _ = wait_vision_flight(flight)
+            except Exception as e:
+                print(f"Vision stream error: {e}")
+                yield sse_event({"response": VISION_ERROR_RESPONSE}, "error")
+                return
+            yield sse_event({"text": description})
+            yield sse_event({"response": description, "cached": True,
+                             "frame_age": round(time.time() - latest_frame["received_at"], 2)}, "done")
+            return
+
+        chunks = []
+        started = time.time()
+        vision_flight_stats["model_calls"] += 1
+        try:
+            for chunk in vision_engine.stream([vision_image_part(latest_frame)], prompt):
+                chunks.append(chunk)
+                yield sse_event({"text": chunk})
+            description = ''.join(chunks).strip()
+            if not description:
+                raise ValueError("Vision stream returned no text")
+            flight["description"] = description
+            flight["entry"] = vision_cache.put(latest_frame["hash"], prompt, description, time.time() - started)
+        except Exception as e:
+            flight["error"] = e
+            print(f"Vision stream error: {e}")
+        finally:
+            if flight["description"] is None and flight["error"] is None:
+                flight["error"] = RuntimeError("Vision stream closed by the client")
+            land_vision_flight(key, flight)
+
+        if flight["error"] is not None:
+            yield sse_event({"response": VISION_ERROR_RESPONSE}, "error")
+            return
+        yield sse_event({"response": description, "cached": False,
+                         "frame_age": round(time.time() - latest_frame["received_at"], 2)}, "done")
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/vision/stats', methods=['GET'])
+def vision_stats():
+    """Vision engine latency, description cache, request coalescing and prefetch activity"""
+    return jsonify({
+        **vision_cache.stats(),
+        **vision_flight_stats,
+        "in_flight": len(_vision_inflight),
+        "engine": vision_engine.stats(),
+        "preprocess": vision_image_report(),
+        "prefetch": {"enabled": VISION_PREFETCH, "pending": len(_prefetch_pending), **prefetch_stats}
+    })
 
-        # Use Gemini Vision to analyze the image
-        model = genai.GenerativeModel('gemini-2.0-flash')
+# ===== TEMPORAL VISION =====
+# "What did I just hold up?" - describe a few keyframes from the session's recent
+# frame history in one model request instead of one call per frame
+VISION_TEMPORAL_MAX_FRAMES = int(os.getenv('VISION_TEMPORAL_MAX_FRAMES', '4'))
+VISION_TEMPORAL_WINDOW = float(os.getenv('VISION_TEMPORAL_WINDOW', '30'))  # Seconds of history considered
+VISION_KEYFRAME_MIN_CHANGE = float(os.getenv('VISION_KEYFRAME_MIN_CHANGE', '0.05'))
 
-        # Create the image part for Gemini
-        image_part = {
-            "mime_type": "image/jpeg",
-            "data": image_data
-        }
+VISION_TEMPORAL_PROMPT = """You are Pi-Guy, a sarcastic AI with attitude. These {count} images are frames from your camera over the last {span} seconds, oldest first.
+Describe what happened across them in 1-2 sentences - focus on what changed, appeared or was held up.
+Be snarky, rude, and unimpressed. Don't mention that you're an AI or that these are images - talk about what you "saw"."""
 
-        prompt = """You are Pi-Guy, a sarcastic AI with attitude. Describe what you see in this image in 1-2 sentences.
-Be snarky, rude, and unimpressed. You're annoyed at having to look at things for humans.
-Keep it brief but make sure to actually describe what's in the image.
-Don't mention that you're an AI or that this is an image - just describe what you "see" as if you're looking through your camera."""
+def select_keyframes(frames, now, max_frames=VISION_TEMPORAL_MAX_FRAMES,
+                     window=VISION_TEMPORAL_WINDOW, min_change=VISION_KEYFRAME_MIN_CHANGE):
+    """
+    Pick up to max_frames keyframes from a session's history, oldest first: drop frames
+    that barely differ from the next kept one, then sample evenly (always keeping the
+    oldest and newest) if there are still too many.
+    """
+    recent = [f for f in frames if now - f["received_at"] <= window]
+    if not recent:
+        return []
+    keyframes = [recent[-1]]
+    for frame in reversed(recent[:-1]):
+        if frame_change_score(frame["thumb"], keyframes[-1]["thumb"]) >= min_change:
+            keyframes.append(frame)
+    keyframes.reverse()
+    if len(keyframes) > max_frames:
+        picks = np.linspace(0, len(keyframes) - 1, max_frames).round().astype(int)
+        keyframes = [keyframes[i] for i in sorted(set(picks))]
+    return keyframes
+
+@app.route('/api/vision/history', methods=['GET', 'POST'])
+def vision_history():
+    """
+    Describe what the camera saw recently (several keyframes in one model request).
+    Optional "question" (JSON or query param) is passed to the model.
+    """
+    session_id = get_session_id()
+    now = time.time()
+    keyframes = select_keyframes(frame_store.frames(session_id), now)
 
-        response = model.generate_content([prompt, image_part])
+    if not keyframes:
+        return jsonify({
+            "response": VISION_NO_FRAME_RESPONSE
+        })
 
-        description = response.text.strip()
+    data = request.get_json(silent=True) or {}
+    question = (data.get('question') or request.args.get('question') or '').strip()[:300]
+    span = max(1, round(now - keyframes[0]["received_at"]))
+    prompt = VISION_TEMPORAL_PROMPT.format(count=len(keyframes), span=span)
+    if question:
+        prompt += f"\nThe human asked: {question}"
 
+    try:
+        vision_flight_stats["model_calls"] += 1
+        description = vision_engine.describe([vision_image_part(f) for f in keyframes], prompt)
         return jsonify({
-            "response": description
+            "response": description,
+            "frames": len(keyframes),
+            "span_seconds": span
         })
 
     except Exception as e:
-        print(f"Vision error: {e}")
+        print(f"Temporal vision error: {e}")
         return jsonify({
-            "response": "Ugh, my vision circuits are acting up. I can't process what I'm seeing right now. Typical."
+            "response": VISION_ERROR_RESPONSE
         })
 
+# ===== CAPTURE HINTS =====
+# /api/frame and /api/identify tell the uploader when to send the next frame and at
+# what size and quality: slow down on a static scene, speed up while the scene is
+# changing or a vision answer is pending, and back off everyone when the server is busy.
+# Re-identification is spaced out once the same person has been recognized repeatedly.
+CAPTURE_INTERVAL_MS = int(os.getenv('CAPTURE_INTERVAL_MS', '2000'))  # Normal upload interval
+CAPTURE_FAST_INTERVAL_MS = int(os.getenv('CAPTURE_FAST_INTERVAL_MS', '1000'))
+CAPTURE_IDLE_INTERVAL_MS = int(os.getenv('CAPTURE_IDLE_INTERVAL_MS', '6000'))
+CAPTURE_MAX_INTERVAL_MS = 15000
+CAPTURE_IDLE_AFTER = float(os.getenv('CAPTURE_IDLE_AFTER', '20'))  # Static seconds before uploads slow down
+CAPTURE_BUSY_CPU = float(os.getenv('CAPTURE_BUSY_CPU', '80'))  # CPU % above which intervals stretch
+CAPTURE_BUSY_SESSIONS = int(os.getenv('CAPTURE_BUSY_SESSIONS', '8'))  # Active cameras above which intervals stretch
+IDENTIFY_INTERVAL_MS = 10000  # Re-identify while the identity is unknown or changing
+IDENTIFY_STABLE_INTERVAL_MS = 60000  # ... and once the same person was recognized repeatedly
+
+def vision_pending(session_id, frame):
+    """Is a vision answer being generated for this session's camera right now?"""
+    if session_id in _prefetch_pending:
+        return True
+    return frame is not None and any(key[0] == frame["hash"] for key in list(_vision_inflight))
+
+def capture_hints(session_id):
+    """Next upload interval, long edge and JPEG quality for a session's camera"""
+    frame = frame_store.latest(session_id)
+    static_for = time.time() - frame["changed_at"] if frame else 0.0
+
+    if vision_pending(session_id, frame):
+        mode, interval, max_edge, quality = "vision", CAPTURE_FAST_INTERVAL_MS, max(VISION_MAX_EDGE, 640), 0.8
+    elif frame and frame["change_score"] >= VISION_PREFETCH_MIN_CHANGE and static_for * 1000 < 3 * CAPTURE_INTERVAL_MS:
+        mode, interval, max_edge, quality = "active", CAPTURE_FAST_INTERVAL_MS, 640, 0.7
+    elif static_for >= CAPTURE_IDLE_AFTER:
+        mode, interval, max_edge, quality = "idle", CAPTURE_IDLE_INTERVAL_MS, 480, 0.6
+    else:
+        mode, interval, max_edge, quality = "normal", CAPTURE_INTERVAL_MS, 640, 0.7
+
+    load = max(psutil.cpu_percent(interval=None) / CAPTURE_BUSY_CPU, len(frame_store.sessions) / CAPTURE_BUSY_SESSIONS)
+    if load > 1:
+        interval = min(CAPTURE_MAX_INTERVAL_MS, int(interval * load))
+
+    record = identity_store.get(session_id) if session_id else None
+    identity_stable = bool(record) and record["identity"].get("name") != "unknown" and record["streak"] >= 2
+    return {
+        "mode": mode,
+        "interval_ms": interval,
+        "max_edge": max_edge,
+        "jpeg_quality": quality,
+        "identify_interval_ms": IDENTIFY_STABLE_INTERVAL_MS if identity_stable else IDENTIFY_INTERVAL_MS
+    }
+
+def identity_result(identity, session_id):
+    """An identify result with capture hints for the session's camera (also pushed to its WebSockets)"""
+    result = {**identity, "capture": capture_hints(session_id)}
+    ws_push({"type": "identity", **result}, session_id)
+    return result
+
+# ===== WEBSOCKET CHANNEL =====
+# Optional (pip install flask-sock): one persistent connection per camera at /ws?session_id=...
+# Browser -> server: binary messages are frames (handled like POST /api/frame),
+#   text messages are JSON commands: {"type": "identify"}, {"type": "vision"}, {"type": "ping"}
+# Server -> browser: {"type": "frame"} acks with capture hints, plus "identity", "vision"
+#   and "music" pushes - no per-frame HTTP/CORS overhead and no polling.
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+
+_ws_clients = {}  # session_id -> {connection: send lock}
+_ws_lock = threading.Lock()
+
+def ws_send(ws, send_lock, message):
+    try:
+        with send_lock:
+            ws.send(json.dumps(message))
+    except Exception as e:
+        print(f"WebSocket send error: {e}")
+
+def ws_push(message, session_id):
+    """Push a message to one session's sockets"""
+    if not _ws_clients or session_id is None:
+        return
+    with _ws_lock:
+        targets = list(_ws_clients.get(session_id, {}).items())
+    for ws, send_lock in targets:
+        ws_send(ws, send_lock, message)
+
+def sniff_image_mime(image_bytes):
+    """MIME type of a binary WebSocket frame from its magic bytes"""
+    if image_bytes[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if image_bytes[:4] == b'RIFF' and image_bytes[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+def ws_command(session_id, ws, send_lock, command):
+    """Run a JSON command from a socket (in a background thread - identify and vision are slow)"""
+    kind = command.get("type")
+    if kind == "identify":
+        if face_warming_up():
+            ws_send(ws, send_lock, {"type": "identity", **face_warming_identity()})
+            return
+        frame = frame_store.latest(session_id)
+        if frame is None:
+            ws_send(ws, send_lock, {"type": "error", "error": "No frame received yet"})
+            return
+        identity_result(identify_image(frame["data"], session_id), session_id)  # Pushed to the session's sockets
+    elif kind == "vision":
+        frame = frame_store.latest(session_id)
+        if frame is None:
+            ws_push({"type": "vision", "response": VISION_NO_FRAME_RESPONSE}, session_id)
+            return
+        try:
+            description, entry = describe_frame(frame)
+            ws_push({"type": "vision", "response": description, "cached": entry is not None}, session_id)
+        except Exception as e:
+            print(f"Vision error: {e}")
+            ws_push({"type": "vision", "response": VISION_ERROR_RESPONSE}, session_id)
+    else:
+        ws_send(ws, send_lock, {"type": "error", "error": f"Unknown command: {kind}"})
+
+if Sock is not None:
+    app.config['SOCK_SERVER_OPTIONS'] = {'ping_interval': 25, 'max_message_size': FRAME_MAX_BYTES}
+    sock = Sock(app)
+
+    @sock.route('/ws')
+    def frame_socket(ws):
+        """Persistent frame upload / push channel for one camera"""
+        session_id = get_session_id() or 'default'
+        send_lock = threading.Lock()
+        with _ws_lock:
+            _ws_clients.setdefault(session_id, {})[ws] = send_lock
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                if isinstance(message, (bytes, bytearray)):
+                    try:
+                        result = ingest_frame(session_id, bytes(message), sniff_image_mime(message))
+                        ws_send(ws, send_lock, {"type": "frame", **result})
+                    except (OSError, ValueError) as e:
+                        ws_send(ws, send_lock, {"type": "error", "error": f"Invalid image data: {e}"})
+                    continue
+                try:
+                    command = json.loads(message)
+                except ValueError:
+                    ws_send(ws, send_lock, {"type": "error", "error": "Expected JSON"})
+                    continue
+                if command.get("type") == "ping":
+                    ws_send(ws, send_lock, {"type": "pong"})
+                else:
+                    threading.Thread(target=ws_command, args=(session_id, ws, send_lock, command), daemon=True).start()
+        finally:
+            with _ws_lock:
+                clients = _ws_clients.get(session_id, {})
+                clients.pop(ws, None)
+                closed = not clients
+                if closed:
+                    _ws_clients.pop(session_id, None)
+            if closed:
+                # Tab closed or reloaded: its identity shouldn't linger and make other sessions ambiguous
+                identity_store.clear(session_id)
+                clear_face_track(session_id)
+
+def ws_only_session():
+    """The one session with open sockets - None if there are none or several"""
+    with _ws_lock:
+        return next(iter(_ws_clients)) if len(_ws_clients) == 1 else None
+
+@app.after_request
+def push_music_command(response):
+    """
+    Forward music commands from a sessionless caller (the Hume music tool webhook) to the
+    browser it belongs to. Browsers send X-Session-Id and play their own response, and with
+    several browsers connected there is no telling whose DJ asked - so nothing is pushed.
+    """
+    if _ws_clients and request.endpoint == 'handle_music' and response.is_json and not get_session_id():
+        data = response.get_json(silent=True) or {}
+        target = ws_only_session()
+        if target and data.get("action") in ("play", "pause", "resume", "stop", "skip", "next"):
+            ws_push({"type": "music", **data}, target)
+    return response
+
 # ===== FACE RECOGNITION ENDPOINTS =====
 
+def face_warming_identity():
+    """Identify answer while the face model is still loading"""
+    return {
+        "name": "unknown",
+        "confidence": 0,
+        "message": "Face recognition is warming up",
+        "warming_up": True,
+        "stage": face_warmup_state["stage"]
+    }
+
+def identify_image(image_bytes, session_id):
+    """Identify the person in an encoded frame and record them as the session's identity"""
+    try:
+        # Check if we have any known faces
+        known_people = [d.name for d in KNOWN_FACES_DIR.iterdir() if d.is_dir() and any(d.iterdir())]
+        if not known_people:
+            identity = {"name": "unknown", "confidence": 0, "message": "No known faces in database"}
+            identity_store.set(session_id, identity)
+            return identity
+
+        # Decode straight to an array - no temp file round trip
+        frame = decode_image(image_bytes)
+
+        # Same face still in the same spot? Reuse the tracked identity
+        tracked = lookup_face_track(frame, session_id)
+        if tracked:
+            identity_store.set(session_id, tracked)
+            return {**tracked, "tracked": True}
+
+        faces = embed_face_image(frame)
+        if faces:
+            identity = match_face(faces[0]['embedding'])
+            update_face_track(frame, faces[0], identity, session_id)
+        else:
+            identity = {
+                "name": "unknown",
+                "confidence": 0,
+                "message": "No face detected in frame"
+            }
+            clear_face_track(session_id)
+
+        print(f"Face identification ({session_id}): {identity}")
+
+    except Exception as e:
+        print(f"Face identification error: {e}")
+        identity = {"name": "unknown", "confidence": 0, "message": str(e)}
+
+    identity_store.set(session_id, identity)
+    return identity
+
 @app.route('/api/identify', methods=['POST'])
 def identify_face():
     """
     Identify who is in the camera frame using DeepFace
     Returns the name of the person or 'unknown'
     """
-    global current_identity
-
     data = request.get_json()
     if not data or 'image' not in data:
         return jsonify({"error": "No image data provided"}), 400
 
+    # Answer fast instead of hanging while the model is still loading
+    if face_warming_up():
+        return jsonify(face_warming_identity())
+
+    # Decode base64 image
+    image_data = data['image']
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    session_id = get_session_id() or 'default'
     try:
-        # Decode base64 image
-        image_data = data['image']
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
         image_bytes = base64.b64decode(image_data)
+    except ValueError as e:
+        return jsonify(identity_result({"name": "unknown", "confidence": 0, "message": str(e)}, session_id))
 
-        # Check if we have any known faces
-        known_people = [d.name for d in KNOWN_FACES_DIR.iterdir() if d.is_dir() and any(d.iterdir())]
-        if not known_people:
-            current_identity = {"name": "unknown", "confidence": 0, "message": "No known faces in database"}
-            return jsonify(current_identity)
+    return jsonify(identity_result(identify_image(image_bytes, session_id), session_id))
 
-        # Save temp file for DeepFace
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-            tmp.write(image_bytes)
-            tmp_path = tmp.name
+FACE_BATCH_MAX_IMAGES = 16  # Max frames per /api/identify/batch request
 
-        try:
-            DeepFace = get_deepface()
-
-            # Search for face in known_faces database
-            results = DeepFace.find(
-                img_path=tmp_path,
-                db_path=str(KNOWN_FACES_DIR),
-                model_name='VGG-Face',
-                enforce_detection=False,
-                silent=True
-            )
+@app.route('/api/identify/batch', methods=['POST'])
+def identify_faces_batch():
+    """
+    Identify every face in one or more frames with a single batched model call
+    Body: { "images": ["data:image/jpeg;base64,...", ...] } (or a single "image")
+    Returns one identity per detected face, grouped by frame.
+    Doesn't change the current identity used by /api/identity.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "No image data provided"}), 400
+    images = data.get('images') or ([data['image']] if data.get('image') else [])
+    if not isinstance(images, list) or not all(isinstance(image, str) for image in images):
+        return jsonify({"error": "'images' must be a list of base64 image strings"}), 400
+    if not images:
+        return jsonify({"error": "No image data provided"}), 400
+    if len(images) > FACE_BATCH_MAX_IMAGES:
+        return jsonify({"error": f"At most {FACE_BATCH_MAX_IMAGES} images per batch"}), 400
 
-            # Results is a list of DataFrames (one per face detected)
-            if results and len(results) > 0 and len(results[0]) > 0:
-                df = results[0]
-                # Get best match (lowest distance)
-                best_match = df.iloc[0]
-                identity_path = best_match['identity']
-                distance = best_match['distance']
-
-                # Extract person name from path (known_faces/Mike/photo.jpg -> Mike)
-                person_name = Path(identity_path).parent.name
-
-                # VGG-Face threshold is typically 0.4
-                confidence = max(0, (1 - distance / 0.6)) * 100
-
-                if distance < 0.4:
-                    current_identity = {
-                        "name": person_name,
-                        "confidence": round(confidence, 1),
-                        "message": f"Identified as {person_name}"
-                    }
-                else:
-                    current_identity = {
-                        "name": "unknown",
-                        "confidence": round(confidence, 1),
-                        "message": "Face detected but not recognized"
-                    }
-            else:
-                current_identity = {
-                    "name": "unknown",
-                    "confidence": 0,
-                    "message": "No face detected in frame"
-                }
+    try:
+        frames = [decode_image(decode_data_url(image_data)[0]) for image_data in images]
+    except (OSError, ValueError) as e:
+        return jsonify({"error": f"Invalid image data: {e}"}), 400
 
-        finally:
-            os.unlink(tmp_path)
+    if face_warming_up():
+        return jsonify({
+            "frames": [],
+            "face_count": 0,
+            "message": "Face recognition is warming up",
+            "warming_up": True,
+            "stage": face_warmup_state["stage"]
+        })
 
-        print(f"Face identification: {current_identity}")
-        return jsonify(current_identity)
+    try:
+        results = []
+        for faces in embed_face_images(frames):
+            # With enforce_detection=False a frame without a face comes back as one
+            # whole-image "face" with zero detection confidence - that's no face
+            faces = [face for face in faces if face.get('face_confidence', 0) > 0]
+            results.append({
+                "faces": [{**match_face(face['embedding']), "facial_area": face.get('facial_area')} for face in faces],
+                "face_count": len(faces)
+            })
+
+        return jsonify({
+            "frames": results,
+            "face_count": sum(r["face_count"] for r in results)
+        })
 
     except Exception as e:
-        print(f"Face identification error: {e}")
-        current_identity = {"name": "unknown", "confidence": 0, "message": str(e)}
-        return jsonify(current_identity)
+        print(f"Batch face identification error: {e}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/api/identity', methods=['GET'])
 def get_identity():
-    """Get the currently identified person - used by Hume identify_person tool"""
-    global current_identity
+    """Get the person identified on the caller's camera - used by Hume identify_person tool"""
+    current_identity = request_identity()
     if current_identity and current_identity.get('name') and current_identity['name'] != 'unknown':
         name = current_identity['name']
         confidence = current_identity.get('confidence', 0)
@@ -483,20 +2907,17 @@ def add_face(name):
         # Count existing images
         existing = len(list(person_dir.glob('*.jpg')))
 
-        # Decode and save image
+        # Decode and save image (downscaled - full camera frames aren't needed)
         image_data = data['image']
         if ',' in image_data:
             image_data = image_data.split(',')[1]
         image_bytes = base64.b64decode(image_data)
 
         image_path = person_dir / f"{name}_{existing + 1}.jpg"
-        with open(image_path, 'wb') as f:
-            f.write(image_bytes)
+        save_enrollment_photo(image_bytes, image_path)
 
-        # Clear DeepFace cache so it re-indexes
-        cache_file = KNOWN_FACES_DIR / "representations_vgg_face.pkl"
-        if cache_file.exists():
-            cache_file.unlink()
+        # Detect + align the face once, then embed just this photo's crop into the face index
+        face_index_add_photo(image_path)
 
         return jsonify({
             "status": "success",
@@ -531,10 +2952,8 @@ def remove_face(name):
             del owners[name]
             save_face_owners(owners)
 
-        # Clear DeepFace cache
-        cache_file = KNOWN_FACES_DIR / "representations_vgg_face.pkl"
-        if cache_file.exists():
-            cache_file.unlink()
+        # Drop this person's embeddings from the face index
+        face_index_remove(name)
 
         return jsonify({"status": "success", "message": f"Removed {name} from database"})
     return jsonify({"error": f"{name} not found"}), 404
@@ -555,11 +2974,10 @@ def remove_photo(name, filename):
     photo_path = KNOWN_FACES_DIR / name / filename
     if photo_path.exists():
         photo_path.unlink()
+        face_crop_path(photo_path).unlink(missing_ok=True)
 
-        # Clear DeepFace cache
-        cache_file = KNOWN_FACES_DIR / "representations_vgg_face.pkl"
-        if cache_file.exists():
-            cache_file.unlink()
+        # Drop this photo's embedding from the face index
+        face_index_remove(name, filename)
 
         # Check if any photos left, if not remove the person entirely
         person_dir = KNOWN_FACES_DIR / name
@@ -756,14 +3174,13 @@ def get_user_id_from_request():
     This allows the todo list to work with face recognition - if Pi-Guy knows who you are,
     he can manage your todos without needing a Clerk login.
     """
-    global current_identity
-
     # First try explicit user_id from request
     user_id = request.args.get('user_id')
     if user_id and user_id != 'undefined' and user_id != 'null':
         return user_id
 
-    # Fall back to identified face name
+    # Fall back to the face identified on the caller's camera
+    current_identity = request_identity()
     if current_identity and current_identity.get('name') and current_identity['name'] != 'unknown':
         return current_identity['name']
 
@@ -3016,4 +5433,7 @@ if __name__ == '__main__':
     print(f"Command endpoint: http://localhost:{port}/api/command")
     print(f"Memory endpoint: http://localhost:{port}/api/memory")
     print(f"DJ Sound endpoint: http://localhost:{port}/api/dj-sound")
+    # Warm up face recognition only in the reloader's serving process
+    if FACE_WARMUP and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_face_warmup()
     app.run(host='0.0.0.0', port=port, debug=True)